@@ -0,0 +1,621 @@
+"""load test of `AutoReaderCog` replaying gateway events
+
+It drives `on_message` and `on_voice_state_update` of the cog with fake
+`Message`, `Member`, `Guild` and `VoiceClient` objects, without a
+Discord connection. Synthesis is done by a stub engine (or the
+`fake_open_jtalk.py` command with `--stub cli`) and each fake voice
+client consumes 20ms frames in real time on its own thread, like the
+audio player of discord.py.
+
+Traffic is synthetic (`-r` messages per second across `-g` guilds) or
+replayed from a JSON Lines trace saved with `--save`:
+
+    {"t": 0.5, "type": "join", "guild": 0, "member": 1}
+    {"t": 1.2, "type": "message", "guild": 0, "member": 1, "content": "..."}
+
+It reports the latency from a message to the start (first audio) and
+the end (done) of its playback, the queue depth over time and the
+messages dropped, truncated or merged.
+
+usage:
+    python3 benchmarks/bench_load.py [-r RATE] [-g GUILDS] [-d SECONDS]
+                                     [--trace TRACE.jsonl] [--save TRACE.jsonl]
+                                     [--set NAME=VALUE ...] [-o OUT.json]
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from typing import Dict, List, Optional
+
+BENCH_DIR = dirname(abspath(__file__))
+sys.path.insert(0, join(BENCH_DIR, '..', 'discordjtalkbot'))
+
+import discord  # noqa: E402
+
+import discordjtalkbot  # noqa: E402
+import fake_open_jtalk  # noqa: E402
+from bench_suite import MESSAGES, install_stub, percentile  # noqa: E402
+from cogs.autoreadercog import AutoReaderCog  # noqa: E402
+from cogs.modules import environ  # noqa: E402
+from cogs.modules import metrics  # noqa: E402
+
+# seconds of a 20ms frame
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+# members of each synthetic guild (the first one is the owner)
+MEMBERS = 4
+
+# rows of the queue depth timeline printed
+TIMELINE_ROWS = 20
+
+# id of the message being dispatched (read by the instrumented sessions)
+_current_message: contextvars.ContextVar = contextvars.ContextVar(
+    'current_message', default=None)
+
+
+class StubEngine(object):
+    """in-process stand-in of the synthesis engine returning the wave of
+    `fake_open_jtalk.py` after a configurable latency """
+
+    def __init__(self, latency: float = 0.05, per_char: float = 0.0):
+        """constructor """
+
+        self.latency = latency
+        self.per_char = per_char
+
+    def _wave(self, text: str, options: dict) -> bytes:
+        """(internal) return the wave data of `text` """
+
+        return fake_open_jtalk.make_wave(
+            text, options.get('sampling') or fake_open_jtalk.SAMPLING,
+            options.get('speedrate') or 1.0)
+
+    def synthesize(self, text: str, options: dict) -> bytes:
+        """return monaural wave data for `text` """
+
+        time.sleep(self.latency + self.per_char * len(text))
+        return self._wave(text, options)
+
+    async def async_synthesize(self, text: str, options: dict) -> bytes:
+        """[Coroutine] return monaural wave data for `text` """
+
+        await asyncio.sleep(self.latency + self.per_char * len(text))
+        return self._wave(text, options)
+
+    def shutdown(self, wait: bool = True):
+        """nothing to release """
+
+
+class FakeMember(object):
+    """member (or the bot user) """
+
+    def __init__(self, id: int, name: str, bot: bool = False):
+        """constructor """
+
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+
+    def __str__(self) -> str:
+        """return `str(self)` """
+
+        return self.name
+
+
+class FakeVoiceState(object):
+    """voice state of a member """
+
+    def __init__(self, channel: Optional['FakeVoiceChannel'] = None):
+        """constructor """
+
+        self.channel = channel
+
+
+class FakeTextChannel(object):
+    """text channel discarding the messages sent """
+
+    def __init__(self, guild: 'FakeGuild', id: int, name: str):
+        """constructor """
+
+        self.guild = guild
+        self.id = id
+        self.name = name
+
+    def __str__(self) -> str:
+        """return `str(self)` """
+
+        return self.name
+
+    async def send(self, content: str = None, **kwds):
+        """[Coroutine] discard a message """
+
+
+class FakeVoiceClient(object):
+    """voice client consuming the frames of a source in real time on a
+    player thread """
+
+    def __init__(self, harness: 'Harness', channel: 'FakeVoiceChannel'):
+        """constructor """
+
+        self.harness = harness
+        self.channel = channel
+        self.guild = channel.guild
+        self._playing = threading.Event()
+        self._stopped = threading.Event()
+
+    def is_connected(self) -> bool:
+        """return whether it is connected """
+
+        return self.guild.voice_client is self
+
+    def is_playing(self) -> bool:
+        """return whether a source is being played """
+
+        return self._playing.is_set()
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        """start playing `source` and call `after` when it ends """
+
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+        self._stopped.clear()
+        self._playing.set()
+        threading.Thread(target=self._play, args=(source, after),
+                         daemon=True).start()
+
+    def stop(self):
+        """stop playing """
+
+        self._stopped.set()
+
+    async def disconnect(self, *, force: bool = False):
+        """[Coroutine] disconnect and dispatch the voice state update """
+
+        self.stop()
+        self.guild.voice_client = None
+        await self.harness.cog.on_voice_state_update(
+            self.harness.bot.user, FakeVoiceState(self.channel),
+            FakeVoiceState())
+
+    def _play(self, source: discord.AudioSource, after):
+        """(internal) player thread """
+
+        item = getattr(source, 'item', None)
+        self.harness.played(item, time.monotonic())
+        start = time.perf_counter()
+        frames = 0
+        while not self._stopped.is_set():
+            if not source.read():
+                break
+            frames += 1
+            delay = start + FRAME_SECONDS * frames - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        source.cleanup()
+        self.harness.finished(item, time.monotonic())
+        # like discord.py, it is no longer playing when `after` is called
+        self._playing.clear()
+        if after is not None:
+            after(None)
+
+
+class FakeVoiceChannel(object):
+    """voice channel """
+
+    def __init__(self, harness: 'Harness', guild: 'FakeGuild', name: str):
+        """constructor """
+
+        self.harness = harness
+        self.guild = guild
+        self.name = name
+        self.members: List[FakeMember] = []
+
+    def __str__(self) -> str:
+        """return `str(self)` """
+
+        return self.name
+
+    async def connect(self) -> FakeVoiceClient:
+        """[Coroutine] connect the bot and dispatch the voice state update """
+
+        self.guild.voice_client = FakeVoiceClient(self.harness, self)
+        self.members.append(self.harness.bot.user)
+        await self.harness.cog.on_voice_state_update(
+            self.harness.bot.user, FakeVoiceState(), FakeVoiceState(self))
+        return self.guild.voice_client
+
+
+class FakeGuild(object):
+    """guild with a voice channel and the text channel of the same name """
+
+    def __init__(self, harness: 'Harness', id: int, members: int):
+        """constructor """
+
+        self.id = id
+        self.name = f'guild{id}'
+        self.members = [FakeMember(id * 1000 + i + 1, f'{self.name}-member{i}')
+                        for i in range(members)]
+        self.owner = self.members[0]
+        self.owner_id = self.owner.id
+        self.voice_channel = FakeVoiceChannel(harness, self, 'general')
+        self.voice_channels = [self.voice_channel]
+        self.text_channels = [FakeTextChannel(self, id * 1000, 'general')]
+        self.voice_client: Optional[FakeVoiceClient] = None
+
+    def __str__(self) -> str:
+        """return `str(self)` """
+
+        return self.name
+
+
+class FakeMessage(object):
+    """message posted to the text channel of a guild """
+
+    def __init__(self, guild: FakeGuild, author: FakeMember, content: str):
+        """constructor """
+
+        self.guild = guild
+        self.channel = guild.text_channels[0]
+        self.author = author
+        self.content = content
+        self.clean_content = content
+
+
+class FakeBot(object):
+    """bot the cog is attached to """
+
+    def __init__(self, prefix: str):
+        """constructor """
+
+        self.user = FakeMember(0, 'jtalkbot', bot=True)
+        self.loop = asyncio.get_event_loop()
+        self.prefix = prefix
+
+    async def get_prefix(self, message: FakeMessage) -> str:
+        """[Coroutine] return the command prefix """
+
+        return self.prefix
+
+
+class MessageRecord(object):
+    """timestamps of a replayed message """
+
+    __slots__ = ['sent', 'queued', 'items', 'first_audio', 'done']
+
+    def __init__(self, sent: float):
+        """constructor """
+
+        self.sent = sent
+        self.queued = False
+        self.items = []
+        self.first_audio: Optional[float] = None
+        self.done: Optional[float] = None
+
+
+def synthetic_trace(rate: float, guilds: int, seconds: float,
+                    seed: int = 0) -> List[dict]:
+    """return events of the members joining the voice channels and
+    messages arriving at `rate` per second (Poisson) across `guilds` """
+
+    rng = random.Random(seed)
+    events = []
+    for g in range(guilds):
+        for m in range(MEMBERS):
+            events.append({'t': 0.05 * m, 'type': 'join', 'guild': g, 'member': m})
+    t = 0.5
+    while rate > 0:
+        t += rng.expovariate(rate)
+        if t >= seconds:
+            break
+        events.append({'t': round(t, 4), 'type': 'message',
+                       'guild': rng.randrange(guilds),
+                       'member': rng.randrange(MEMBERS),
+                       'content': rng.choice(MESSAGES)})
+    return events
+
+
+class Harness(object):
+    """replays events to a cog and records the playback of each message """
+
+    def __init__(self, guilds: int, engine: Optional[StubEngine]):
+        """constructor """
+
+        appenv = environ.get_appenv()
+        self.bot = FakeBot(str(appenv.get('prefix', '$')))
+        self.cog = AutoReaderCog(self.bot)
+        if engine is not None:
+            self.cog.agent.engine = engine
+        self.guilds = [FakeGuild(self, i, MEMBERS) for i in range(guilds)]
+        self.records: Dict[int, MessageRecord] = {}
+        self.timeline: List[dict] = []
+        self._lock = threading.Lock()
+        self._item_messages: Dict[int, List[int]] = {}
+        self._finished = set()
+        self._new_session = self.cog.new_session
+        self.cog.new_session = self._instrumented_session
+
+    def _instrumented_session(self, vch):
+        """(internal) return a new session of the cog recording which
+        items each message is queued as """
+
+        session = self._new_session(vch)
+        talk = session.talk
+        render = session.queue.render
+
+        def traced_talk(*args, **kwds):
+            items = talk(*args, **kwds)
+            message_id = _current_message.get()
+            if message_id is not None:
+                record = self.records[message_id]
+                record.queued = record.queued or bool(items)
+                for item in items:
+                    record.items.append(item)
+                    self._item_messages.setdefault(id(item), []).append(message_id)
+            return items
+
+        async def traced_render(item):
+            source = await render(item)
+            return TracedSource(source, item) if source is not None else None
+
+        session.talk = traced_talk
+        session.queue.render = traced_render
+        return session
+
+    def played(self, item, at: float):
+        """record the start of the playback of `item` (player thread) """
+
+        if item is None:
+            return
+        with self._lock:
+            for message_id in self._item_messages.get(id(item), ()):
+                record = self.records[message_id]
+                if record.first_audio is None:
+                    record.first_audio = at
+
+    def finished(self, item, at: float):
+        """record the end of the playback of `item` (player thread) """
+
+        if item is None:
+            return
+        with self._lock:
+            self._finished.add(id(item))
+            for message_id in self._item_messages.get(id(item), ()):
+                record = self.records[message_id]
+                if record.done is None and all(
+                        id(i) in self._finished for i in record.items):
+                    record.done = at
+
+    async def dispatch(self, event: dict):
+        """[Coroutine] dispatch a gateway event to the cog """
+
+        guild = self.guilds[event['guild']]
+        member = guild.members[event['member'] % len(guild.members)]
+        if event['type'] == 'message':
+            message_id = len(self.records)
+            self.records[message_id] = MessageRecord(time.monotonic())
+            _current_message.set(message_id)
+            await self.cog.on_message(FakeMessage(guild, member, event['content']))
+        elif event['type'] == 'join':
+            vch = guild.voice_channel
+            if member not in vch.members:
+                vch.members.append(member)
+                await self.cog.on_voice_state_update(
+                    member, FakeVoiceState(), FakeVoiceState(vch))
+        elif event['type'] == 'leave':
+            vch = guild.voice_channel
+            if member in vch.members:
+                vch.members.remove(member)
+                await self.cog.on_voice_state_update(
+                    member, FakeVoiceState(vch), FakeVoiceState())
+
+    async def sample(self, start: float, interval: float):
+        """[Coroutine] record the queue depth every `interval` seconds """
+
+        while True:
+            self.timeline.append({
+                't': round(time.monotonic() - start, 3),
+                'queue_depth': metrics.QUEUE_DEPTH.value,
+                'backlog_s': round(metrics.BACKLOG_SECONDS.value, 3),
+                'synth_waiting': metrics.SYNTH_WAITING.value,
+                'speedrate': metrics.SPEEDRATE.value,
+                'loop_lag_ms': round(self.cog.lag_monitor.last * 1000, 3),
+            })
+            await asyncio.sleep(interval)
+
+    async def run(self, events: List[dict], drain: float, interval: float):
+        """[Coroutine] replay `events` on their timestamps and wait up to
+        `drain` seconds for the queues to be played out """
+
+        await self.cog.on_ready()
+        start = time.monotonic()
+        sampler = asyncio.ensure_future(self.sample(start, interval))
+        tasks = []
+        for event in sorted(events, key=lambda e: e['t']):
+            delay = start + event['t'] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # each event is handled in its own task like discord.py
+            tasks.append(asyncio.ensure_future(self.dispatch(event)))
+        await asyncio.gather(*tasks)
+
+        deadline = time.monotonic() + drain
+        while time.monotonic() < deadline:
+            if not any(len(s.queue) or (s.voice_client and s.voice_client.is_playing())
+                       for s in self.cog.sessions):
+                break
+            await asyncio.sleep(0.1)
+        elapsed = time.monotonic() - start
+        sampler.cancel()
+        for session in self.cog.sessions:
+            await session.queue.close()
+        self.cog.cog_unload()
+        await asyncio.sleep(0)
+        return elapsed
+
+
+class TracedSource(discord.AudioSource):
+    """audio source remembering the queued item it is rendered from """
+
+    def __init__(self, source: discord.AudioSource, item):
+        """constructor """
+
+        self.source = source
+        self.item = item
+
+    def read(self) -> bytes:
+        """return a 20ms frame of the source """
+
+        return self.source.read()
+
+    def is_opus(self) -> bool:
+        """return whether the frames are Opus packets """
+
+        return self.source.is_opus()
+
+    def cleanup(self):
+        """clean up the source """
+
+        self.source.cleanup()
+
+
+def report(harness: Harness, elapsed: float) -> dict:
+    """return and print the latency, the drops and the timeline """
+
+    records = list(harness.records.values())
+    first = sorted(r.first_audio - r.sent for r in records if r.first_audio)
+    done = sorted(r.done - r.sent for r in records if r.done)
+    shed = sum(1 for r in records if not r.queued)
+    # queued but not played until the end of the drain
+    unplayed = sum(1 for r in records if r.queued and r.first_audio is None)
+
+    def stats(values: List[float]) -> dict:
+        return {
+            'n': len(values),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p90_ms': percentile(values, 90) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': (values[-1] if values else 0.0) * 1000,
+        }
+
+    result = {
+        'elapsed_s': elapsed,
+        'messages': len(records),
+        'played': len(first),
+        'shed': shed,
+        'unplayed': unplayed,
+        'first_audio': stats(first),
+        'done': stats(done),
+        'counters': {
+            'utterances': metrics.UTTERANCES.value,
+            'coalesced': metrics.COALESCED.value,
+            'truncated': metrics.TRUNCATED.value,
+            'shed': metrics.SHED.value,
+            'dropped': metrics.DROPPED.value,
+            'synth_failures': metrics.SYNTH_FAILURES.value,
+        },
+        'timeline': harness.timeline,
+    }
+
+    print(f'messages {len(records)} in {elapsed:.1f}s: played {len(first)},'
+          f' shed {shed}, unplayed {unplayed}')
+    print(f'{"latency":<12} {"n":>6} {"p50":>10} {"p90":>10} {"p99":>10} {"max":>10}')
+    for name in ('first_audio', 'done'):
+        s = result[name]
+        print(f'{name:<12} {s["n"]:>6} {s["p50_ms"]:>8.1f}ms {s["p90_ms"]:>8.1f}ms'
+              f' {s["p99_ms"]:>8.1f}ms {s["max_ms"]:>8.1f}ms')
+    print(' '.join(f'{k} {int(v)}' for k, v in result['counters'].items()))
+
+    print(f'\n{"t":>7} {"depth":>6} {"backlog":>9} {"waiting":>8}'
+          f' {"rate":>6} {"lag":>9}')
+    timeline = harness.timeline
+    step = max(1, len(timeline) // TIMELINE_ROWS)
+    for row in timeline[::step]:
+        print(f'{row["t"]:>6.1f}s {int(row["queue_depth"]):>6}'
+              f' {row["backlog_s"]:>8.1f}s {int(row["synth_waiting"]):>8}'
+              f' {row["speedrate"]:>6.2f}'
+              f' {row["loop_lag_ms"]:>7.1f}ms')
+    return result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-r', '--rate', type=float, default=2.0,
+                        help='messages per second across the guilds (%(default)s)')
+    parser.add_argument('-g', '--guilds', type=int, default=4,
+                        help='number of guilds (%(default)s)')
+    parser.add_argument('-d', '--duration', type=float, default=30.0,
+                        help='seconds of the synthetic traffic (%(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the synthetic traffic (%(default)s)')
+    parser.add_argument('--trace', help='JSON Lines trace to replay')
+    parser.add_argument('--save', help='save the replayed trace as JSON Lines')
+    parser.add_argument('--stub', choices=('engine', 'cli'), default='engine',
+                        help='in-process stub engine or fake open_jtalk command (%(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='latency of the stub in seconds (%(default)s)')
+    parser.add_argument('--per-char', type=float, default=0.0,
+                        help='latency of the stub per character (%(default)s)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='bot setting, e.g. --set latency_target=10')
+    parser.add_argument('--drain', type=float, default=60.0,
+                        help='max seconds to wait for the queues after the traffic (%(default)s)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between samples of the queue depth (%(default)s)')
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    ns_args = parser.parse_args()
+
+    if ns_args.trace:
+        with open(ns_args.trace, encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = synthetic_trace(ns_args.rate, ns_args.guilds,
+                                 ns_args.duration, ns_args.seed)
+    if ns_args.save:
+        with open(ns_args.save, 'w', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+    guilds = max((e['guild'] for e in events), default=0) + 1
+
+    # per-message logs of the cog would dominate the measurements
+    logging.disable(logging.INFO)
+    appenv = environ.get_appenv()
+    discordjtalkbot.add_fields(appenv)
+    settings = {'PREWARM': 'False', 'RELOAD_INTERVAL': '0'}
+    for item in ns_args.set:
+        name, _, value = item.partition('=')
+        settings[name.strip().upper()] = value
+    appenv.load_env(settings)
+
+    engine = None
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory() as workdir:
+        if ns_args.stub == 'cli':
+            install_stub(workdir)
+            os.environ[fake_open_jtalk.LATENCY_ENV] = str(ns_args.latency)
+            os.environ[fake_open_jtalk.PER_CHAR_ENV] = str(ns_args.per_char)
+        else:
+            engine = StubEngine(ns_args.latency, ns_args.per_char)
+        harness = Harness(guilds, engine)
+        elapsed = loop.run_until_complete(
+            harness.run(events, ns_args.drain, ns_args.interval))
+    result = report(harness, elapsed)
+    result['settings'] = settings
+
+    if ns_args.output:
+        with open(ns_args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
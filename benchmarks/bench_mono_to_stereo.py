@@ -0,0 +1,76 @@
+"""micro-benchmark of `openjtalk.mono_to_stereo`
+
+usage: python3 benchmarks/bench_mono_to_stereo.py [-n REPEAT]
+"""
+
+import io
+import os
+import sys
+import timeit
+import wave
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', 'discordjtalkbot'))
+
+from cogs.modules import openjtalk  # noqa: E402
+
+DURATIONS = [1, 10, 60]
+RATE = openjtalk.FREQ_48000HZ
+SAMPWIDTH = 2
+
+
+def legacy_mono_to_stereo(file) -> bytes:
+    """per-frame implementation used before the bulk interleave """
+
+    with io.BytesIO() as stream, \
+    wave.open(file, 'rb') as wi, \
+    wave.open(stream, 'wb') as wo:
+        wo.setnchannels(2)
+        wo.setsampwidth(wi.getsampwidth())
+        wo.setframerate(wi.getframerate())
+        nframes = wi.getnframes()
+        wo.setnframes(nframes)
+        gen_frames = (wi.readframes(1) for _ in range(nframes))
+        [wo.writeframesraw(f * 2) for f in gen_frames]
+        return stream.getvalue()
+
+
+def make_mono_wave(seconds: int) -> bytes:
+    """return monaural wave bytes of random noise """
+
+    with io.BytesIO() as stream:
+        with wave.open(stream, 'wb') as wo:
+            wo.setnchannels(1)
+            wo.setsampwidth(SAMPWIDTH)
+            wo.setframerate(RATE)
+            wo.writeframes(os.urandom(RATE * SAMPWIDTH * seconds))
+        return stream.getvalue()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    ns_args = parser.parse_args()
+
+    backend = 'numpy' if openjtalk.np is not None else 'bytearray'
+    print(f'mono_to_stereo ({backend}), best of {ns_args.repeat}')
+    print(f'{"clip":>6} {"legacy":>10} {"bulk":>10} {"speedup":>8}')
+    for seconds in DURATIONS:
+        data = make_mono_wave(seconds)
+        expected = legacy_mono_to_stereo(io.BytesIO(data))
+        if openjtalk.mono_to_stereo(io.BytesIO(data)) != expected:
+            raise SystemExit(f'output mismatch on {seconds}s clip')
+
+        legacy = min(timeit.repeat(
+            lambda: legacy_mono_to_stereo(io.BytesIO(data)),
+            number=1, repeat=ns_args.repeat))
+        bulk = min(timeit.repeat(
+            lambda: openjtalk.mono_to_stereo(io.BytesIO(data)),
+            number=1, repeat=ns_args.repeat))
+        print(f'{seconds:>5}s {legacy * 1000:>8.1f}ms {bulk * 1000:>8.2f}ms'
+              f' {legacy / bulk:>7.0f}x')
+
+
+if __name__ == "__main__":
+    main()
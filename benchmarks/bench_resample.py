@@ -0,0 +1,173 @@
+"""CPU cost and quality of low-rate synthesis with upsampling to 48kHz
+
+For each rate it measures the CPU time of the polyphase resampler per
+second of audio and its transparency on a band-limited test signal.
+If a working `open_jtalk` is given with `--flags`, it also measures the
+CPU time of `open_jtalk` per second of audio and the log-spectral
+distance of the upsampled output from the native 48kHz one.
+
+usage:
+    python3 benchmarks/bench_resample.py [--flags FLAGS] [-r RATE ...]
+"""
+
+import io
+import resource
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+import wave
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from typing import Optional, Tuple
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', 'discordjtalkbot'))
+
+from cogs.modules import openjtalk  # noqa: E402
+from cogs.modules import resample  # noqa: E402
+
+if openjtalk.np is None:
+    raise SystemExit('this benchmark requires NumPy')
+np = openjtalk.np
+
+RATES = [16000, 22050, 24000, 32000]
+TARGET = openjtalk.FREQ_48000HZ
+TEXT = 'きょうはいい天気ですね。ボイスチャンネルで、みんなとゲームをしましょう。'
+
+# frame length and hop of the spectral comparison in seconds
+SPEC_FRAME = 0.025
+SPEC_HOP = 0.010
+
+
+def test_signal(rate: int, seconds: float, top: float) -> 'np.ndarray':
+    """return a chirp up to `top` Hz and tones sampled at `rate` """
+
+    t = np.arange(int(rate * seconds)) / rate
+    chirp = np.sin(2 * np.pi * (100 * t + (top - 100) / (2 * seconds) * t * t))
+    tones = sum(np.sin(2 * np.pi * f * t + f) for f in (150, 440, 1234, 3000))
+    return (chirp + tones) * 3000
+
+
+def snr(signal: 'np.ndarray', reference: 'np.ndarray') -> float:
+    """return signal-to-noise ratio of `signal` to `reference` in dB """
+
+    n = min(len(signal), len(reference))
+    error = signal[:n] - reference[:n]
+    return 10 * np.log10(np.sum(reference[:n] ** 2) / np.sum(error ** 2))
+
+
+def log_spectral_distance(signal: 'np.ndarray', reference: 'np.ndarray',
+                          rate: int, max_freq: float) -> float:
+    """return the mean log-spectral distance in dB between 48kHz signals
+    up to `max_freq` Hz """
+
+    size = int(SPEC_FRAME * rate)
+    hop = int(SPEC_HOP * rate)
+    n = min(len(signal), len(reference))
+    window = np.hanning(size)
+    bins = int(max_freq / rate * size) + 1
+    distances = []
+    for start in range(0, n - size, hop):
+        a = np.abs(np.fft.rfft(signal[start:start + size] * window))[:bins]
+        b = np.abs(np.fft.rfft(reference[start:start + size] * window))[:bins]
+        if b.max() < 1e-3 * size:
+            # skip silence
+            continue
+        # compare down to 60dB below the peak of the reference
+        floor = b.max() * 1e-3
+        d = 20 * np.log10(np.maximum(a, floor) / np.maximum(b, floor))
+        distances.append(np.sqrt(np.mean(d ** 2)))
+    return float(np.mean(distances)) if distances else float('nan')
+
+
+def resampler_cpu(rate: int, seconds: float = 10.0) -> float:
+    """return CPU seconds of the resampler per second of audio """
+
+    frames = test_signal(rate, seconds, 0.4 * rate).astype('<i2').tobytes()
+    resample.resample_frames(frames, rate, TARGET)
+    start = time.process_time()
+    repeat = 5
+    for _ in range(repeat):
+        resample.resample_frames(frames, rate, TARGET)
+    return (time.process_time() - start) / repeat / seconds
+
+
+def resampler_quality(rate: int) -> Tuple[float, float]:
+    """return SNR and log-spectral distance of the upsampled test signal
+    against the same signal generated at 48kHz """
+
+    seconds = 2.0
+    frames = test_signal(rate, seconds, 0.4 * rate).astype('<i2').tobytes()
+    upsampled = np.frombuffer(
+        resample.resample_frames(frames, rate, TARGET), '<i2').astype(float)
+    reference = test_signal(TARGET, seconds, 0.4 * rate)
+    # leave the edges out of the comparison
+    edge = resample.TAPS * TARGET // rate
+    upsampled, reference = upsampled[edge:-edge], reference[edge:-edge]
+    return (snr(upsampled, reference),
+            log_spectral_distance(upsampled, reference, TARGET, 0.4 * rate))
+
+
+def synthesize(flags: str, rate: int) -> Tuple[Optional['np.ndarray'], float]:
+    """return 48kHz samples of `TEXT` synthesized by `open_jtalk` at
+    `rate` (upsampled) and CPU seconds per second of audio """
+
+    args = [openjtalk.OPEN_JTALK] + shlex.split(flags) \
+        + ['-s', str(rate), '-p', str(rate // 200), '-ow', openjtalk.WAVE_STDOUT]
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc = subprocess.run(args, input=TEXT.encode(openjtalk.ENCODING),
+                          stdout=subprocess.PIPE)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if proc.returncode != 0 or not proc.stdout:
+        return None, 0.0
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+    with wave.open(io.BytesIO(proc.stdout)) as wi:
+        frames = wi.readframes(wi.getnframes())
+        seconds = wi.getnframes() / wi.getframerate()
+    start = time.process_time()
+    frames = resample.resample_frames(frames, rate, TARGET)
+    cpu += time.process_time() - start
+    return np.frombuffer(frames, '<i2').astype(float), cpu / seconds
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-r', '--rate', type=int, action='append',
+                        help=f'synthesis rates to compare ({RATES})')
+    parser.add_argument('--flags', help='open_jtalk flags (-x DICT -m VOICE)'
+                        ' to measure synthesis, skipped if not given')
+    ns_args = parser.parse_args()
+    rates = ns_args.rate or RATES
+
+    print(f'resampler (taps per branch {resample.TAPS})')
+    print(f'{"rate":>6} {"cpu/s":>10} {"snr":>8} {"lsd":>8}')
+    for rate in rates:
+        cpu = resampler_cpu(rate)
+        quality_snr, lsd = resampler_quality(rate)
+        print(f'{rate:>6} {cpu * 1000:>8.3f}ms {quality_snr:>6.1f}dB {lsd:>6.2f}dB')
+
+    if not ns_args.flags:
+        return
+    if shutil.which(openjtalk.OPEN_JTALK) is None:
+        raise SystemExit(f'{openjtalk.OPEN_JTALK} command not found')
+
+    print(f'\n{openjtalk.OPEN_JTALK} (vs native {TARGET}Hz)')
+    print(f'{"rate":>6} {"cpu/s":>10} {"speedup":>8} {"lsd":>8}')
+    native, native_cpu = synthesize(ns_args.flags, TARGET)
+    if native is None:
+        raise SystemExit(f'failed to run {openjtalk.OPEN_JTALK} {ns_args.flags}')
+    print(f'{TARGET:>6} {native_cpu * 1000:>8.1f}ms {1:>7.2f}x {0:>6.2f}dB')
+    for rate in rates:
+        samples, cpu = synthesize(ns_args.flags, rate)
+        if samples is None:
+            print(f'{rate:>6} failed')
+            continue
+        lsd = log_spectral_distance(samples, native, TARGET, 0.4 * rate)
+        print(f'{rate:>6} {cpu * 1000:>8.1f}ms {native_cpu / cpu:>7.2f}x'
+              f' {lsd:>6.2f}dB')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""benchmark suite of the synthesis and audio pipeline
+
+It runs offline with `fake_open_jtalk.py` in place of `open_jtalk`
+command, measures each stage and the whole pipeline, prints throughput
+and p50/p99 latency and saves them as JSON that can be compared with the
+results of another commit.
+
+usage:
+    python3 benchmarks/bench_suite.py [-n REPEAT] [-o OUT.json]
+                                      [--compare BASE.json] [STAGE ...]
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from typing import Callable, List, Optional, Sequence
+
+BENCH_DIR = dirname(abspath(__file__))
+sys.path.insert(0, join(BENCH_DIR, '..', 'discordjtalkbot'))
+
+import fake_open_jtalk  # noqa: E402
+from cogs.modules import audiosource  # noqa: E402
+from cogs.modules import openjtalk  # noqa: E402
+from cogs.modules.normalizer import Normalizer  # noqa: E402
+
+FLAGS = '-x /usr/local/opt/open-jtalk/dic' \
+    ' -m /usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice' \
+    ' -r 1.0 -fm 0.0 -jf 1.0'
+
+MESSAGES = [
+    'おはようございます',
+    'きょうはいい天気ですね。散歩にでも行きましょうか？',
+    '見て||ネタバレ注意||草\nhttps://example.com/watch?v=abc <:wave:1234>',
+    '長いメッセージです。' * 12,
+    'ゲームしようぜ！ボイスチャンネルに来てね、待ってるよ。',
+]
+
+MONO_SECONDS = 3
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """return the nearest-rank percentile of sorted values """
+
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[float]) -> dict:
+    """return throughput and latency statistics of per-call seconds """
+
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        'n': len(values),
+        'total_s': total,
+        'ops_per_s': len(values) / total if total else 0.0,
+        'mean_ms': total / len(values) * 1000 if values else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+    }
+
+
+def measure(func: Callable[[int], object], repeat: int) -> List[float]:
+    """call `func(i)` `repeat` times and return the seconds of each """
+
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def async_measure(func: Callable[[int], object], repeat: int
+                        ) -> List[float]:
+    """[Coroutine] await `func(i)` `repeat` times and return the seconds
+    of each """
+
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        await func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def install_stub(workdir: str) -> str:
+    """put an `open_jtalk` wrapper of the stub in `workdir`, prepend it to
+    `PATH` and return its path """
+
+    path = join(workdir, openjtalk.OPEN_JTALK)
+    script = join(BENCH_DIR, 'fake_open_jtalk.py')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write(f'exec {shlex.quote(sys.executable)} {shlex.quote(script)} "$@"\n')
+    os.chmod(path, 0o755)
+    os.environ['PATH'] = workdir + os.pathsep + os.environ.get('PATH', '')
+    return path
+
+
+def new_agent() -> openjtalk.Agent:
+    """return an agent configured like the bot without cache """
+
+    agent = openjtalk.Agent.from_flags(FLAGS)
+    agent.sampling = openjtalk.FREQ_48000HZ
+    return agent
+
+
+def bench_build_args(repeat: int) -> List[float]:
+    agent = new_agent()
+    return measure(lambda i: agent.build_args(outwave=openjtalk.WAVE_STDOUT),
+                   repeat)
+
+
+def bench_config(repeat: int) -> List[float]:
+    agent = new_agent()
+    return measure(lambda i: agent.config(voice=openjtalk.VOICE).argv, repeat)
+
+
+def bench_parse_args(repeat: int) -> List[float]:
+    args = shlex.split(FLAGS)
+    return measure(lambda i: openjtalk.parse_args(args), repeat)
+
+
+def bench_normalize(repeat: int) -> List[float]:
+    normalizer = Normalizer()
+    return measure(
+        lambda i: normalizer.normalize(MESSAGES[i % len(MESSAGES)]), repeat)
+
+
+def bench_split_sentences(repeat: int) -> List[float]:
+    return measure(
+        lambda i: openjtalk.split_sentences(MESSAGES[i % len(MESSAGES)]),
+        repeat)
+
+
+def bench_mono_to_stereo(repeat: int) -> List[float]:
+    data = fake_open_jtalk.make_wave('あ' * int(MONO_SECONDS / fake_open_jtalk.CHAR_SECONDS))
+    return measure(lambda i: openjtalk.mono_to_stereo(io.BytesIO(data)),
+                   repeat)
+
+
+def bench_wave_source(repeat: int) -> List[float]:
+    data = fake_open_jtalk.make_wave('あ' * int(MONO_SECONDS / fake_open_jtalk.CHAR_SECONDS))
+
+    def read_all(i):
+        source = audiosource.WavePCMSource(data)
+        while source.read():
+            pass
+
+    return measure(read_all, repeat)
+
+
+def bench_talk(repeat: int) -> List[float]:
+    agent = new_agent()
+    return measure(lambda i: agent.talk(MESSAGES[i % len(MESSAGES)]), repeat)
+
+
+async def _end_to_end(repeat: int, first_frame: bool) -> List[float]:
+    normalizer = Normalizer()
+    agent = new_agent()
+    agent.executor = openjtalk.SynthesisExecutor()
+
+    async def render(text: str) -> audiosource.WavePCMSource:
+        data = await agent.async_talk(text, stereo=False)
+        return audiosource.WavePCMSource(data)
+
+    async def pipeline(i):
+        message = normalizer.normalize(MESSAGES[i % len(MESSAGES)])
+        chunks = openjtalk.split_sentences(message)
+        tasks = [asyncio.ensure_future(render(c)) for c in chunks]
+        for source in await asyncio.gather(*tasks):
+            source.read()
+
+    if not first_frame:
+        return await async_measure(pipeline, repeat)
+
+    # time to the first frame of the first chunk
+    samples = []
+    for i in range(repeat):
+        message = normalizer.normalize(MESSAGES[i % len(MESSAGES)])
+        start = time.perf_counter()
+        chunks = openjtalk.split_sentences(message)
+        tasks = [asyncio.ensure_future(render(c)) for c in chunks]
+        (await tasks[0]).read()
+        samples.append(time.perf_counter() - start)
+        await asyncio.gather(*tasks)
+    return samples
+
+
+def bench_first_frame(repeat: int) -> List[float]:
+    return asyncio.get_event_loop().run_until_complete(
+        _end_to_end(repeat, True))
+
+
+def bench_end_to_end(repeat: int) -> List[float]:
+    return asyncio.get_event_loop().run_until_complete(
+        _end_to_end(repeat, False))
+
+
+# (name, function, repeat multiplier): micro-benchmarks run more times
+STAGES = [
+    ('build_args', bench_build_args, 100),
+    ('config', bench_config, 100),
+    ('parse_args', bench_parse_args, 100),
+    ('normalize', bench_normalize, 100),
+    ('split_sentences', bench_split_sentences, 100),
+    ('mono_to_stereo', bench_mono_to_stereo, 1),
+    ('wave_source', bench_wave_source, 1),
+    ('talk', bench_talk, 1),
+    ('first_frame', bench_first_frame, 1),
+    ('end_to_end', bench_end_to_end, 1),
+]
+
+
+def git_revision() -> Optional[str]:
+    """return the commit hash of the working tree (if available) """
+
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=BENCH_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return proc.stdout.decode().strip() or None
+
+
+def compare(results: dict, base: dict):
+    """print the ratio of p50/p99 latency to the base results """
+
+    print(f'\ncompared with {base["meta"].get("revision")}'
+          f' ({base["meta"].get("date")})')
+    print(f'{"stage":<16} {"p50":>10} {"ratio":>7} {"p99":>10} {"ratio":>7}')
+    for name, stats in results['stages'].items():
+        old = base['stages'].get(name)
+        if old is None:
+            print(f'{name:<16} {stats["p50_ms"]:>8.3f}ms {"new":>7}')
+            continue
+        r50 = stats['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 0.0
+        r99 = stats['p99_ms'] / old['p99_ms'] if old['p99_ms'] else 0.0
+        print(f'{name:<16} {stats["p50_ms"]:>8.3f}ms {r50:>6.2f}x'
+              f' {stats["p99_ms"]:>8.3f}ms {r99:>6.2f}x')
+
+
+def main():
+    names = [name for name, _, _ in STAGES]
+    parser = ArgumentParser()
+    parser.add_argument('stages', nargs='*', metavar='STAGE',
+                        help=f'stages to run: {", ".join(names)} (all)')
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='number of runs of each stage (%(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='latency of the stub in seconds (%(default)s)')
+    parser.add_argument('--per-char', type=float, default=0.0,
+                        help='latency of the stub per character (%(default)s)')
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='BASE',
+                        help='JSON results to compare with')
+    ns_args = parser.parse_args()
+    for name in ns_args.stages:
+        if name not in names:
+            parser.error(f'unknown stage: {name}')
+
+    # per-call logs of the pipeline would dominate the measurements
+    logging.disable(logging.INFO)
+    os.environ[fake_open_jtalk.LATENCY_ENV] = str(ns_args.latency)
+    os.environ[fake_open_jtalk.PER_CHAR_ENV] = str(ns_args.per_char)
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': openjtalk.np is not None,
+            'repeat': ns_args.repeat,
+            'latency': ns_args.latency,
+            'per_char': ns_args.per_char,
+        },
+        'stages': {},
+    }
+
+    print(f'{"stage":<16} {"n":>6} {"ops/s":>10} {"p50":>10} {"p99":>10}')
+    with tempfile.TemporaryDirectory() as workdir:
+        install_stub(workdir)
+        for name, func, multiplier in STAGES:
+            if ns_args.stages and name not in ns_args.stages:
+                continue
+            stats = summarize(func(ns_args.repeat * multiplier))
+            results['stages'][name] = stats
+            print(f'{name:<16} {stats["n"]:>6} {stats["ops_per_s"]:>10.1f}'
+                  f' {stats["p50_ms"]:>8.3f}ms {stats["p99_ms"]:>8.3f}ms')
+
+    if ns_args.output:
+        with open(ns_args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if ns_args.compare:
+        with open(ns_args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
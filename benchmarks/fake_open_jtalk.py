@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""stub of `open_jtalk` command for offline benchmarks
+
+It accepts the same command line as `open_jtalk`, waits for a
+configurable latency and writes a deterministic monaural 16bit wave
+(a 400Hz tone, `CHAR_SECONDS` per character) to the `-ow` file.
+
+environment variables:
+    FAKE_OPEN_JTALK_LATENCY   seconds to wait per invocation (0)
+    FAKE_OPEN_JTALK_PER_CHAR  seconds to wait per character (0)
+"""
+
+import io
+import math
+import os
+import struct
+import sys
+import time
+import wave
+from typing import Sequence
+
+ENCODING = sys.getfilesystemencoding()
+SAMPLING = 48000
+SAMPWIDTH = 2
+TONE_HZ = 400
+AMPLITUDE = 8000
+CHAR_SECONDS = 0.12
+
+LATENCY_ENV = 'FAKE_OPEN_JTALK_LATENCY'
+PER_CHAR_ENV = 'FAKE_OPEN_JTALK_PER_CHAR'
+
+# options of `open_jtalk` taking a value
+VALUE_OPTIONS = {
+    '-x', '-m', '-ow', '-ot', '-s', '-p', '-a', '-b', '-r', '-fm',
+    '-u', '-jm', '-jf', '-z',
+}
+
+
+def make_wave(text: str, sampling: int = SAMPLING, speedrate: float = 1.0
+              ) -> bytes:
+    """return the monaural wave bytes the stub outputs for `text` """
+
+    nframes = int(len(text) * CHAR_SECONDS / speedrate * sampling)
+    period = [int(AMPLITUDE * math.sin(2 * math.pi * TONE_HZ * i / sampling))
+              for i in range(sampling // math.gcd(sampling, TONE_HZ))]
+    pcm = struct.pack(f'<{len(period)}h', *period)
+    repeat, rest = divmod(nframes, len(period))
+    with io.BytesIO() as stream:
+        with wave.open(stream, 'wb') as wo:
+            wo.setnchannels(1)
+            wo.setsampwidth(SAMPWIDTH)
+            wo.setframerate(sampling)
+            wo.writeframes(pcm * repeat + pcm[:rest * SAMPWIDTH])
+        return stream.getvalue()
+
+
+def main(argv: Sequence[str]) -> int:
+    opts = {}
+    infile = None
+    i = 0
+    while i < len(argv):
+        if argv[i] in VALUE_OPTIONS and i + 1 < len(argv):
+            opts[argv[i]] = argv[i + 1]
+            i += 2
+        else:
+            infile = argv[i]
+            i += 1
+    if '-ow' not in opts:
+        print('fake_open_jtalk: -ow is required', file=sys.stderr)
+        return 1
+
+    if infile is not None:
+        with open(infile, encoding=ENCODING) as f:
+            text = f.read()
+    else:
+        text = sys.stdin.buffer.read().decode(ENCODING)
+    text = text.strip()
+
+    latency = float(os.getenv(LATENCY_ENV, '0'))
+    latency += float(os.getenv(PER_CHAR_ENV, '0')) * len(text)
+    if latency > 0:
+        time.sleep(latency)
+
+    data = make_wave(text, int(opts.get('-s', SAMPLING)),
+                     float(opts.get('-r', 1.0)))
+    if opts['-ow'] == '/dev/stdout':
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(opts['-ow'], 'wb') as f:
+            f.write(data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,11 +1,10 @@
 """auto reader plugin """
 
 import asyncio
-import io
 import logging
-import re
+import math
 import os
-import random
+import time
 from os.path import join, dirname
 
 import discord
@@ -13,11 +12,21 @@ from discord import member
 from discord.ext import commands
 
 from .modules import environ
+from .modules import metrics
 from .modules import openjtalk
+from .modules import resample
+from .modules.admission import POLICY_DROP, AdmissionControl
+from .modules.normalizer import Normalizer, load_readings
+from .modules.pagecache import ResidentFiles
+from .modules.session import GuildSession, SessionManager, prewarm
+from .modules.speedrate import AdaptiveSpeedrate
 
 logging.basicConfig()
 LOG = logging.getLogger(__name__)
 
+# byte budget of the pre-encoded Opus clip cache
+OPUS_CACHE_BYTES = 8 * 1024 * 1024
+
 
 class AutoReaderCog(commands.Cog):
 
@@ -28,16 +37,91 @@ class AutoReaderCog(commands.Cog):
         appenv = environ.get_appenv()
         flags = appenv.get('open_jtalk_flags', '')
         self.agent = openjtalk.Agent.from_flags(flags)
-        self.agent.sampling = openjtalk.FREQ_48000HZ
-        self.vch = None
-
-        self.member_name = ''
-        LOG.debug("voices:" + appenv.get('voices', ''))
-        voices = str(appenv.get('voices', '')).split(',')
-        self.voices = voices
-        self.voices_init = voices
-        self.voice_init = self.agent.voice
-        self.member2voice = {}
+        # 低いサンプリング周波数で合成して48kHzにアップサンプリングする(要NumPy)
+        synth_rate = int(appenv.get('synth_rate', openjtalk.FREQ_48000HZ))
+        if synth_rate != openjtalk.FREQ_48000HZ and not resample.is_available():
+            LOG.warning(f'synth_rate {synth_rate} requires NumPy, use {openjtalk.FREQ_48000HZ}.')
+            synth_rate = openjtalk.FREQ_48000HZ
+        self.agent.sampling = synth_rate
+        if synth_rate != openjtalk.FREQ_48000HZ:
+            # フレーム周期は5msのまま(指定がなければ声の設定になり、話速が変わる)
+            if self.agent.frameperiod is None:
+                self.agent.frameperiod = max(1, synth_rate // 200)
+            LOG.info(f'synthesize at {synth_rate}Hz, frame period {self.agent.frameperiod}.')
+        # 辞書と声のファイルを先にページキャッシュに読み込んでおく(設定があればメモリに固定する)
+        self.resident_files = None
+        lock_files = bool(appenv.get('lock_files', False))
+        if appenv.get('warm_files', False) or lock_files:
+            paths = [self.agent.dictionary, self.agent.voice]
+            paths.extend(appenv.get('voices', ()))
+            self.resident_files = ResidentFiles(paths, lock=lock_files).load()
+            LOG.info(f'warmed files: {self.resident_files}')
+        # 同じ文章・同じ声の音声はキャッシュから返す
+        cache_bytes = int(appenv.get('cache_bytes', openjtalk.CACHE_BYTES))
+        if cache_bytes > 0:
+            self.agent.cache = openjtalk.WaveCache(cache_bytes)
+        # あいさつや入退室など繰り返し再生する音声は、Opusに符号化済みのものをキャッシュする
+        opus_cache_bytes = int(appenv.get('opus_cache_bytes', OPUS_CACHE_BYTES))
+        self.opus_cache = None
+        if opus_cache_bytes > 0:
+            self.opus_cache = openjtalk.WaveCache(opus_cache_bytes)
+        # open_jtalkの同時実行数と待ち行列の上限
+        self.agent.executor = openjtalk.SynthesisExecutor(
+            int(appenv.get('synth_workers', openjtalk.SYNTH_WORKERS)),
+            int(appenv.get('synth_queue', openjtalk.SYNTH_QUEUE)),
+            str(appenv.get('synth_overflow', openjtalk.OVERFLOW_REJECT)))
+        # 辞書と声を読み込んだままのエンジンを使う(使えなければopen_jtalkコマンド)
+        engine = str(appenv.get('engine', openjtalk.ENGINE_CLI))
+        if engine == openjtalk.ENGINE_RESIDENT:
+            try:
+                self.agent.engine = openjtalk.ResidentEngine(
+                    self.agent.dictionary, self.agent.executor.max_workers)
+                LOG.info(f'engine: {self.agent.engine}')
+            except openjtalk.OpenJTalkError as e:
+                LOG.warning(f'{e}, fall back to {openjtalk.OPEN_JTALK} command.')
+        elif engine != openjtalk.ENGINE_CLI:
+            LOG.warning(f'unknown engine {engine!r}, use {openjtalk.OPEN_JTALK} command.')
+        # ギルドごとの読み上げセッション
+        self.sessions = SessionManager()
+
+        # 再生中に先読みして合成しておく件数
+        self.readahead = int(appenv.get('synth_readahead', 1))
+        # 長いメッセージは文ごとに分けて合成する(0なら分けない)
+        self.chunk_chars = int(appenv.get('chunk_chars', openjtalk.CHUNK_CHARS))
+        # 再生中に同じチャンネル・同じ声で続けて投稿されたメッセージはまとめて合成する
+        self.coalesce = int(appenv.get('coalesce_ms', 0)) / 1000
+        # 読み上げ待ちが長くなったら話速を上げる(上限が話速以下なら変えない)
+        self.speedrate_max = float(appenv.get('speedrate_max', 0.0))
+        self.speedrate_high = float(appenv.get('speedrate_high', 20.0))
+        self.speedrate_low = float(appenv.get('speedrate_low', 5.0))
+        # 設定のスナップショット(設定ファイルが変更されたら読み込み直す)
+        self.settings = None
+        self.normalizer = None
+        self.apply_settings(appenv.snapshot)
+        self.reload_task = None
+        # 統計情報(メトリクス)
+        metrics.QUEUE_DEPTH.set_function(
+            lambda: sum(len(s.queue) for s in self.sessions))
+        metrics.ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        metrics.CACHE_HIT_RATE.set_function(
+            lambda: self.agent.cache.hit_rate if self.agent.cache else math.nan)
+        metrics.OPUS_CACHE_HIT_RATE.set_function(
+            lambda: self.opus_cache.hit_rate if self.opus_cache else math.nan)
+        metrics.BACKLOG_SECONDS.set_function(
+            lambda: max((s.queue.backlog() for s in self.sessions), default=0.0))
+        metrics.SPEEDRATE.set_function(
+            lambda: max((s.speedrate or 1.0 for s in self.sessions),
+                        default=self.agent.speedrate or 1.0))
+        metrics.SYNTH_WAITING.set_function(lambda: self.agent.executor.waiting)
+        self.lag_monitor = metrics.LoopLagMonitor()
+        self.prewarm_task = None
+        metrics_port = int(appenv.get('metrics_port', 0))
+        self.metrics_server = None
+        if metrics_port > 0:
+            # launcher.pyで起動したワーカーはポート番号をずらす
+            self.metrics_server = metrics.MetricsServer(
+                host=str(appenv.get('metrics_host', '127.0.0.1')),
+                port=metrics_port + int(appenv.get('worker', 0)))
         LOG.info("_init_")
 
     # Botの準備完了時に呼び出されるイベント
@@ -47,6 +131,103 @@ class AutoReaderCog(commands.Cog):
 
         bot = self.bot
         LOG.info('We have logged in as {0}'.format(bot.user))
+        self.lag_monitor.start()
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                LOG.warning(f'failed to start metrics server: {e}')
+
+        # 設定ファイルで設定されていれば、決まった文言を全ての声で先に合成しておく
+        if self.settings.prewarm and self.prewarm_task is None:
+            self.prewarm_task = asyncio.ensure_future(self.prewarm())
+        self.start_watching_settings()
+
+    def apply_settings(self, settings):
+        """swap in a new snapshot of the settings """
+
+        old = self.settings
+        # 読み上げないプレフィックス(空の項目は除かれている)
+        self.except_prefixes = settings.except_prefix
+        self.voices = list(settings.voices)
+        LOG.debug(f'voices: {self.voices}')
+        if old is not None and old.voices != settings.voices:
+            # 接続中のセッションは声を振り分け直す
+            for session in self.sessions:
+                session.voices_init = list(self.voices)
+                session.voices = []
+                session.member2voice.clear()
+        # 読み上げが遅れすぎないように、長いメッセージを省略したり捨てたりする
+        try:
+            self.admission = AdmissionControl(
+                settings.latency_target, settings.max_message_seconds,
+                settings.latency_policy)
+        except ValueError as e:
+            LOG.warning(f'{e}, use {POLICY_DROP}.')
+            self.admission = AdmissionControl(
+                settings.latency_target, settings.max_message_seconds)
+        for session in self.sessions:
+            session.admission = self.admission
+        # URLや絵文字の置き換えと読み方辞書の適用を1回の走査で行う
+        if old is None or old.reading_dict != settings.reading_dict:
+            self.normalizer = Normalizer(self.load_readings(settings.reading_dict))
+        self.settings = settings
+        # 読み込み直しで確認の間隔が正に戻ったら、確認を再開する
+        if old is not None and settings.reload_interval > 0:
+            self.start_watching_settings()
+
+    def load_readings(self, reading_dict: str) -> dict:
+        """return the reading dictionary (empty if not set or broken) """
+
+        if not reading_dict:
+            return {}
+        if not os.path.isabs(reading_dict):
+            reading_dict = join(dirname(__file__), 'modules', 'files', reading_dict)
+        try:
+            readings = load_readings(reading_dict)
+        except (OSError, ValueError) as e:
+            LOG.warning(f'failed to load reading_dict: {e}')
+            return {}
+        LOG.info(f'reading_dict: {len(readings)} words from {reading_dict}')
+        return readings
+
+    async def watch_settings(self):
+        """[Coroutine] reload the settings when the setting file is
+        changed """
+
+        appenv = environ.get_appenv()
+        # 間隔が0以下に変更されたら確認をやめる
+        while self.settings.reload_interval > 0:
+            await asyncio.sleep(self.settings.reload_interval)
+            if appenv.refresh():
+                LOG.info('settings are reloaded.')
+                self.apply_settings(appenv.snapshot)
+        LOG.info('stopped watching the settings.')
+
+    def start_watching_settings(self):
+        """start `watch_settings` if `reload_interval` is positive and it
+        is not running """
+
+        if self.settings.reload_interval <= 0:
+            return
+        if self.reload_task is None or self.reload_task.done():
+            self.reload_task = asyncio.ensure_future(self.watch_settings())
+
+    async def prewarm(self):
+        """[Coroutine] synthesize the fixed phrases with every voice into
+        the caches """
+
+        # text_start/text_endはテキストチャンネルに投稿するだけなので対象外
+        texts = [self.settings.voice_hello, '停止']
+        voices = [self.agent.voice] + self.voices
+        start = time.perf_counter()
+        try:
+            count = await prewarm(self.agent, texts, voices, self.opus_cache,
+                                  self.chunk_chars)
+        except Exception:
+            LOG.exception('failed to prewarm')
+            return
+        LOG.info(f'prewarmed {count} clips in {time.perf_counter() - start:.2f}s.')
 
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
@@ -55,50 +236,45 @@ class AutoReaderCog(commands.Cog):
         bot = self.bot
         if msg.author == bot.user:
             return
+        if not self.sessions:
+            return
 
-        tch = self.vch
-        if self.vch:
-            vcl = discord.utils.get(
-                bot.voice_clients, channel__guild=tch.guild, channel__name=tch.name)
-            if vcl:
-                # 何もなかったら無視
-                if len(msg.clean_content) == 0:
-                    return
-                # コマンドは無視
-                if msg.clean_content.startswith(await self.bot.get_prefix(msg)):
-                    return
+        # 何もなかったら無視
+        if len(msg.clean_content) == 0:
+            return
+        # コマンドは無視
+        if msg.clean_content.startswith(await self.bot.get_prefix(msg)):
+            return
+
+        if self.except_prefixes and msg.clean_content.startswith(self.except_prefixes):
+            return
 
-                appenv = environ.get_appenv()
-                command = str(appenv.get('except_prefix', '')).split(',')
-                for ignore_command in command:
-                    if msg.clean_content.startswith(ignore_command):
-                        return
-
-                # 設定ファイルで設定されていれば、他のギルドも読み上げる
-                if not appenv.get('read_all_guild') == 'True':
-                    # 接続しているギルド以外は無視
-                    if msg.guild != tch.guild:
-                        return
-
-                LOG.info(f'!!Reading {msg.author}\'s post on t:{tch.guild}/{tch}!!.')
-                if msg.author.bot:
-                    self.member_name = 'ボット'
-                else:
-                    self.member_name = msg.author.display_name
-
-                # URL省略
-                message = re.sub('http(s)?://[\w.,~:#%-]+\w+(/[\w .,/?%&=~:#-]*)?','URL省略', msg.clean_content)
-                # ネタバレ削除
-                message = re.sub(r'[|]+.+?[|]+', 'ネタバレ', message)
-                # 絵文字無視
-                message = re.sub(r'<:\w+:\d+>', '絵文字', message)
-                # 改行対策
-                message = re.sub('\n', '。。', message)
-
-                # 設定ファイルで設定されていれば、名前を読み上げる
-                if appenv.get('read_name') == 'True':
-                    message = f'{self.member_name}さん、' + message
-                await self.talk(vcl, message)
+        settings = self.settings
+        session = self.sessions.get(msg.guild.id) if msg.guild else None
+        if session is None and settings.read_all_guild:
+            # 設定ファイルで設定されていれば、他のギルドのメッセージも指定したギルドで読み上げる
+            # (接続している全てのギルドには流さない)
+            session = self.sessions.get(settings.read_all_guild_target)
+        if session is None:
+            # 接続しているギルド以外は無視
+            return
+
+        if msg.author.bot:
+            member_name = 'ボット'
+        else:
+            member_name = msg.author.display_name
+
+        # URL省略・ネタバレ削除・絵文字無視・改行対策・読み方辞書
+        start = time.perf_counter()
+        message = self.normalizer.normalize(msg.clean_content)
+        metrics.NORMALIZE_SECONDS.observe(time.perf_counter() - start)
+        metrics.MESSAGES.inc()
+
+        # 設定ファイルで設定されていれば、名前を読み上げる
+        if settings.read_name:
+            message = f'{member_name}さん、' + message
+        LOG.info(f'!!Reading {msg.author}\'s post on t:{session.guild}/{session.vch}!!.')
+        session.talk(message, member_name, msg.channel.id)
 
     @commands.Cog.listener()
     async def on_voice_state_update(
@@ -109,91 +285,94 @@ class AutoReaderCog(commands.Cog):
         """Called when a `Member` changes their `VoiceState`. """
 
         bot = self.bot
-        appenv = environ.get_appenv()
+        settings = self.settings
 
         if not before.channel and after.channel:
             # someone connected the voice channel.
             vch = after.channel
             guild = vch.guild
-            if member == vch.guild.owner and self.vch is None:
+            if member == vch.guild.owner and guild.id not in self.sessions:
                 LOG.info(f'Guild owner {member} connected v:{guild}/{vch}.')
-                vcl = await vch.connect()
-                self.vch = vch
+                await self.open_session(vch)
             elif member == bot.user:
                 LOG.info(f'{member} connected v:{guild}/{vch}.')
-                vcl = discord.utils.get(bot.voice_clients, channel=vch)
-                if vcl:
-                    await self.talk(vcl, appenv['voice_hello'])
+                session = self.sessions.get(guild.id)
+                if session is None:
+                    # コマンド以外で接続された場合もセッションを作る
+                    session = self.sessions.add(self.new_session(vch))
+                if settings.voice_hello:
+                    session.talk(settings.voice_hello)
                 tch = discord.utils.get(guild.text_channels, name=vch.name)
-                if tch:
-                    await tch.send(appenv['text_start'])
+                if tch and settings.text_start:
+                    await tch.send(settings.text_start)
             else:
                 LOG.info(f'{member} connected v:{guild}/{vch}.')
 
                 # 設定ファイルで設定されていれば、入退室を読み上げる
-                if appenv.get('read_system_message') == 'True':
-                    LOG.info(f"read_system_message: {appenv.get('read_system_message')}")
-                    vcl = discord.utils.get(bot.voice_clients, channel=vch)
-                    if vcl:
-                        await self.talk(vcl, f'{member.display_name}さんが接続しました')
+                if settings.read_system_message:
+                    LOG.info(f"read_system_message: {settings.read_system_message}")
+                    session = self.sessions.get(guild.id)
+                    if session and session.vch == vch:
+                        session.talk(f'{member.display_name}さんが接続しました')
 
         elif before.channel and not after.channel:
             # someone disconnected the voice channel.
             vch = before.channel
             guild = vch.guild
-            if member.id == vch.guild.owner_id:
+            if member == bot.user:
+                LOG.info(f'{member} disconnected v:{guild}/{vch}.')
+                await self.sessions.close(guild.id)
+            elif member.id == vch.guild.owner_id:
                 LOG.info(f'Guild owner {member} disconnected v:{guild}/{vch}.')
-                vcl = discord.utils.get(bot.voice_clients, channel=vch)
-                if vcl and vcl.is_connected():
-                    await vcl.disconnect()
-                    self.vch = None
+                await self.sessions.close(guild.id)
                 tch = discord.utils.get(guild.text_channels, name=vch.name)
-                if tch:
-                    await tch.send(appenv['text_end'])
+                if tch and settings.text_end:
+                    await tch.send(settings.text_end)
             else:
                 LOG.info(f'{member} disconnected v:{guild}/{vch}.')
+                session = self.sessions.get(guild.id)
+                if session is None or session.vch != vch:
+                    return
 
                 # 設定ファイルで設定されていれば、入退室を読み上げる
-                if appenv.get('read_system_message') == 'True':
-                    LOG.info(f"read_system_message: {appenv.get('read_system_message')}")
-                    vcl = discord.utils.get(bot.voice_clients, channel=vch)
-                    if vcl:
-                        await self.talk(vcl, f'{member.display_name}さんが切断しました')
+                if settings.read_system_message:
+                    LOG.info(f"read_system_message: {settings.read_system_message}")
+                    session.talk(f'{member.display_name}さんが切断しました')
 
                 # 誰もいなくなったら切断する
-                vcl = discord.utils.get(bot.voice_clients, channel=vch)
-                if len(vch.members) == 1 and vcl and vcl.is_connected():
-                    await vcl.disconnect()
-                    self.vch = None
-
-    async def talk(self, vcl: discord.VoiceClient, text: str):
-        if len(self.voices) == 0 or not self.member_name:
-            LOG.debug('default voice.')
-            self.agent.voice = self.voice_init
-            data = await self.agent.async_talk(text)
-        else:
-            # メンバーにボイスを対応させる
-            self._set_member2voice()
-            self.agent.voice = self.member2voice[self.member_name]
-            LOG.debug('member:' + self.member_name + ', voice:' + self.agent.voice)
-            data = await self.agent.async_talk(text)
-            self.member_name = ''
-
-        voice_name = re.sub('.+/', '', self.agent.voice)
-        LOG.info(f'talk({voice_name}):{text}')
-        stream = io.BytesIO(data)
-        audio = discord.PCMAudio(stream)
-        sleeptime = 0.1
-        timeout = 6.0
-        for _ in range(int(timeout / sleeptime)):
-            if vcl.is_connected():
-                break
-            await asyncio.sleep(sleeptime)
-        else:
-            return
-        while vcl.is_playing():
-            await asyncio.sleep(0.1)
-        vcl.play(audio, after=lambda e: stream.close())
+                if len(vch.members) == 1:
+                    await self.sessions.close(guild.id)
+
+    def new_session(self, vch: discord.VoiceChannel) -> GuildSession:
+        """return a new session for the voice channel """
+
+        speed = None
+        base = self.agent.speedrate or 1.0
+        if self.speedrate_max > base:
+            try:
+                speed = AdaptiveSpeedrate(
+                    base, self.speedrate_max,
+                    high=self.speedrate_high, low=self.speedrate_low)
+            except ValueError as e:
+                LOG.warning(f'{e}, speedrate is fixed.')
+        return GuildSession(vch.guild, vch, self.agent, self.voices,
+                            readahead=self.readahead,
+                            chunk_chars=self.chunk_chars,
+                            opus_cache=self.opus_cache,
+                            coalesce=self.coalesce,
+                            admission=self.admission,
+                            speed=speed)
+
+    async def open_session(self, vch: discord.VoiceChannel) -> GuildSession:
+        """register a new session and connect to the voice channel """
+
+        session = self.sessions.add(self.new_session(vch))
+        try:
+            await vch.connect()
+        except Exception:
+            self.sessions.discard(vch.guild.id)
+            raise
+        return session
 
     async def cmd_connect(self, ctx: commands.Context):
         """connect to the voice channel the name of which is the same as
@@ -220,13 +399,12 @@ class AutoReaderCog(commands.Cog):
         member = ctx.author
         voice_state = ctx.author.voice
 
-        if voice_state is not None and self.vch is None:
+        if voice_state is not None and guild.id not in self.sessions:
             if voice_state.channel is not None:
                 vch = voice_state.channel
 
                 LOG.info(f'Executed command {member} connected v:{guild}/{vch}.')
-                vcl = await vch.connect()
-                self.vch = vch
+                await self.open_session(vch)
 
     @commands.command(aliases=['d','dc','disco','setsudan'],description='ボイスチャンネルからBotを切断するコマンドです')
     async def disconnect(self, ctx: commands.Context):
@@ -234,42 +412,84 @@ class AutoReaderCog(commands.Cog):
         guild = ctx.guild
         member = ctx.author
 
-        # voice_state = ctx.author.voice
-
-        if self.vch is not None:
-            LOG.info(f'Executed command {member} **disconnected** v:{guild}/{self.vch}.')
-            vcl = self.vch.guild.voice_client
-            if vcl and vcl.channel.name == self.vch.name and vcl.is_connected():
-                await vcl.disconnect()
-            self.vch = None
-            LOG.info("set self.vch to None")
+        session = self.sessions.get(guild.id)
+        if session is not None:
+            LOG.info(f'Executed command {member} **disconnected** v:{guild}/{session.vch}.')
+            await self.sessions.close(guild.id)
 
     @commands.command(aliases=['s','tomeru'],description='Botの発言を止めさせるコマンドです')
     async def stop(self, ctx: commands.Context):
         """ Botの発言を止めさせるコマンドです """
-        vcl = self.vch.guild.voice_client
+        session = self.sessions.get(ctx.guild.id)
 
         # 再生を停止
-        if vcl and vcl.is_playing():
-            vcl.stop()
-            await self.talk(vcl, '停止')
+        if session and session.stop():
+            session.talk('停止')
             LOG.info("stop talking")
 
-    def _set_member2voice(self):
-        # すでに登録されているか確認
-        if self.member_name in self.member2voice:
-            return
-
-        # voicesがあるならシャッフルしておき、ないなら初期のものを持ってくる
-        if self.voices:
-            random.shuffle(self.voices)
-        else:
-            self.voices = random.shuffle(self.voices_init)
-
-        voice = self.voices.pop()
-        name = self.member_name
-        self.member2voice[name]=voice
-        LOG.info(f'set voice({voice}) to member({name}).')
+    @commands.command(aliases=['st','toukei'],description='読み上げの統計情報を表示するコマンドです')
+    async def stats(self, ctx: commands.Context):
+        """ 読み上げの統計情報を表示するコマンドです """
+
+        def ms(seconds: float) -> str:
+            if math.isnan(seconds):
+                return '-'
+            return f'{seconds * 1000:.3f}ms' if seconds < 0.01 else f'{seconds * 1000:.1f}ms'
+
+        lines = [
+            f'セッション: {len(self.sessions)}',
+            f'読み上げ待ち: {int(metrics.QUEUE_DEPTH.value)}',
+            f'合成待ち: {int(metrics.SYNTH_WAITING.value)}',
+            f'話速: {metrics.SPEEDRATE.value:.2f}',
+            f'メッセージ: {int(metrics.MESSAGES.value)}',
+            f'再生: {int(metrics.UTTERANCES.value)}'
+            f' (失敗 {int(metrics.SYNTH_FAILURES.value)}'
+            f', 破棄 {int(metrics.DROPPED.value)}'
+            f', まとめて合成 {int(metrics.COALESCED.value)}'
+            f', 省略 {int(metrics.TRUNCATED.value)}'
+            f', 間引き {int(metrics.SHED.value)})',
+        ]
+        hit_rate = metrics.CACHE_HIT_RATE.value
+        if not math.isnan(hit_rate):
+            lines.append(f'キャッシュヒット率: {hit_rate:.1%}')
+        hit_rate = metrics.OPUS_CACHE_HIT_RATE.value
+        if not math.isnan(hit_rate):
+            lines.append(f'Opusキャッシュヒット率: {hit_rate:.1%}')
+        lines.append(f'イベントループ遅延: {ms(self.lag_monitor.last)}')
+        lines.append('')
+        # p50/p99はヒストグラムのバケットの上限値
+        lines.append('処理時間 (件数 平均 p50 p99):')
+        for label, histogram in [
+                ('正規化', metrics.NORMALIZE_SECONDS),
+                ('再生待ち', metrics.QUEUE_WAIT_SECONDS),
+                ('合成', metrics.SYNTH_SECONDS),
+                ('リサンプリング', metrics.RESAMPLE_SECONDS),
+                ('ステレオ変換', metrics.STEREO_SECONDS),
+                ('Opus符号化', metrics.OPUS_ENCODE_SECONDS),
+                ('再生', metrics.PLAYBACK_SECONDS),
+                ('ループ遅延', metrics.EVENT_LOOP_LAG_SECONDS)]:
+            count = histogram.count
+            mean = histogram.sum / count if count else math.nan
+            lines.append(f'{label}: {count} {ms(mean)}'
+                         f' ≤{ms(histogram.quantile(0.5))}'
+                         f' ≤{ms(histogram.quantile(0.99))}')
+        await ctx.send('```\n' + '\n'.join(lines) + '\n```')
+
+    def cog_unload(self):
+        """close all the sessions when the cog is unloaded """
+
+        self.bot.loop.create_task(self.sessions.close_all())
+        if self.prewarm_task is not None:
+            self.prewarm_task.cancel()
+        if self.reload_task is not None:
+            self.reload_task.cancel()
+        self.lag_monitor.stop()
+        if self.metrics_server is not None:
+            self.bot.loop.create_task(self.metrics_server.close())
+        if self.agent.engine is not None:
+            self.agent.engine.shutdown(wait=False)
+        if self.resident_files is not None:
+            self.resident_files.release()
 
 def setup(bot: commands.Bot):
     BOT_NAME = 'discordjtalkbot'
@@ -0,0 +1,84 @@
+"""admission control of messages against a reading latency target """
+
+import logging
+from typing import Optional
+
+from . import metrics
+from . import openjtalk
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'AdmissionControl',
+]
+
+
+# policies for a message that would exceed the latency target
+POLICY_DROP = 'drop'
+POLICY_SUMMARIZE = 'summarize'
+POLICIES = (POLICY_DROP, POLICY_SUMMARIZE)
+
+# shortest seconds of a message worth reading when summarized
+MIN_SECONDS = 1.0
+
+
+class AdmissionControl(object):
+    """decide whether and how much of a message is queued for reading
+
+    Durations are estimated from the text length and the speed rate
+    (see `openjtalk.estimate_seconds`). A message longer than
+    `max_seconds` is truncated. A message that would finish later than
+    `latency_target` seconds from now behind the estimated backlog is
+    dropped, or summarized (truncated) to fit in the rest of the target
+    with `POLICY_SUMMARIZE`. A message to an idle queue is always
+    admitted. 0 disables each limit.
+    """
+
+    __slots__ = ['latency_target', 'max_seconds', 'policy']
+
+    def __init__(self, latency_target: float = 0.0, max_seconds: float = 0.0,
+                 policy: str = POLICY_DROP):
+        """constructor """
+
+        if policy not in POLICIES:
+            raise ValueError(f'unknown latency policy: {policy!r}')
+        self.latency_target = latency_target
+        self.max_seconds = max_seconds
+        self.policy = policy
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__}' \
+            + f' target:{self.latency_target}s max:{self.max_seconds}s' \
+            + f' policy:{self.policy}>'
+
+    def admit(self, text: str, backlog: float,
+              speedrate: Optional[float] = None) -> Optional[str]:
+        """return `text` (possibly truncated) to be queued behind `backlog`
+        seconds of speech, or `None` to drop it """
+
+        if self.max_seconds > 0:
+            truncated = openjtalk.truncate_text(text, self.max_seconds, speedrate)
+            if not truncated:
+                LOG.info(f'dropped longer than {self.max_seconds}s: {text!r}')
+                metrics.SHED.inc()
+                return None
+            if truncated != text:
+                metrics.TRUNCATED.inc()
+                text = truncated
+        if self.latency_target <= 0 or backlog <= 0:
+            return text
+
+        budget = self.latency_target - backlog
+        if openjtalk.estimate_seconds(text, speedrate) <= budget:
+            return text
+        if self.policy == POLICY_SUMMARIZE and budget >= MIN_SECONDS:
+            truncated = openjtalk.truncate_text(text, budget, speedrate)
+            if truncated:
+                metrics.TRUNCATED.inc()
+                return truncated
+        LOG.info(f'dropped behind {backlog:.1f}s of backlog: {text!r}')
+        metrics.SHED.inc()
+        return None
@@ -0,0 +1,302 @@
+"""discord audio sources for synthesized voices """
+
+import logging
+import struct
+import time
+from typing import Callable, Iterable, Optional, Sequence, Tuple
+
+import discord
+
+from . import metrics
+from . import openjtalk
+from . import resample
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'OpusEncodingSource',
+    'OpusPacketSource',
+    'WaveFormatError',
+    'WavePCMSource',
+    'ogg_opus',
+    'pack_packets',
+    'parse_wave',
+]
+
+
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+FRAME_LENGTH = discord.opus.Encoder.FRAME_LENGTH
+SAMPLING_RATE = discord.opus.Encoder.SAMPLING_RATE
+SAMPLE_WIDTH = discord.opus.Encoder.SAMPLE_SIZE // discord.opus.Encoder.CHANNELS
+
+WAVE_FORMAT_PCM = 1
+
+# length prefix of each Opus packet in packed data
+_PACKET_HEADER = struct.Struct('<H')
+
+# Ogg page header (without the segment table) and Opus headers (RFC 7845)
+_OGG_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+_OPUS_HEAD = struct.Struct('<8sBBHIhB')
+OGG_OPUS_VENDOR = b'discordjtalkbot'
+
+# samples at 48kHz the decoder skips at the beginning (encoder lookahead)
+OGG_OPUS_PRE_SKIP = 312
+
+# Opus packets in an Ogg page (1 second)
+OGG_PACKETS_PER_PAGE = 50
+
+
+def _ogg_crc_table():
+    """(internal) return the table of the CRC-32 used by Ogg
+    (polynomial 0x04c11db7, not reflected) """
+
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04c11db7) if r & 0x80000000 else r << 1
+        table.append(r & 0xffffffff)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+
+class WaveFormatError(ValueError):
+    """unsupported or broken wave data """
+    pass
+
+
+def parse_wave(data: bytes) -> Tuple[int, int, int, int, int]:
+    """parse RIFF wave header of `data` and return a tuple of
+    `(nchannels, sampwidth, framerate, offset, length)` where `offset` and
+    `length` locate the PCM payload in `data` """
+
+    if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise WaveFormatError('not a RIFF wave data')
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size, = struct.unpack_from('<I', data, pos + 4)
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', data, body)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WaveFormatError('data chunk before fmt chunk')
+            format_tag, nchannels, framerate, _, _, bits = fmt
+            if format_tag != WAVE_FORMAT_PCM:
+                raise WaveFormatError(f'not a linear PCM: {format_tag}')
+            length = min(chunk_size, len(data) - body)
+            return nchannels, bits // 8, framerate, body, length
+        # chunks are padded to even size
+        pos = body + chunk_size + (chunk_size & 1)
+    raise WaveFormatError('data chunk not found')
+
+
+class WavePCMSource(discord.AudioSource):
+    """`AudioSource` serving 20ms frames straight from the PCM payload of
+    48kHz 16bit wave data, expanding monaural data to stereo frame by
+    frame
+
+    Monaural data of other sampling rates is upsampled to 48kHz at once
+    on construction (requires NumPy).
+    """
+
+    def __init__(self, data: bytes):
+        """constructor """
+
+        nchannels, sampwidth, framerate, offset, length = parse_wave(data)
+        if sampwidth != SAMPLE_WIDTH:
+            raise WaveFormatError(f'sample width must be {SAMPLE_WIDTH}: {sampwidth}')
+        if nchannels not in (1, 2):
+            raise WaveFormatError(f'unsupported number of channels: {nchannels}')
+        if framerate != SAMPLING_RATE:
+            if nchannels != 1 or not resample.is_available():
+                raise WaveFormatError(f'sampling rate must be {SAMPLING_RATE}: {framerate}')
+            start = time.perf_counter()
+            data = resample.resample_frames(
+                memoryview(data)[offset:offset + length], framerate, SAMPLING_RATE)
+            metrics.RESAMPLE_SECONDS.observe(time.perf_counter() - start)
+            offset, length = 0, len(data)
+
+        self._pcm = memoryview(data)[offset:offset + length]
+        self._mono = nchannels == 1
+        self._chunk_size = FRAME_SIZE // 2 if self._mono else FRAME_SIZE
+        self._pos = 0
+
+    @property
+    def duration(self) -> float:
+        """Length of the audio in seconds """
+
+        return len(self._pcm) / self._chunk_size * FRAME_LENGTH / 1000
+
+    def read(self) -> bytes:
+        """return next 20ms stereo frame (`b''` at the end) """
+
+        pos = self._pos
+        chunk = self._pcm[pos:pos + self._chunk_size]
+        if not chunk:
+            return b''
+        self._pos = pos + len(chunk)
+        if self._mono:
+            start = time.perf_counter()
+            frame = openjtalk.mono_to_stereo_frames(chunk, SAMPLE_WIDTH)
+            metrics.STEREO_SECONDS.observe(time.perf_counter() - start)
+        else:
+            frame = chunk.tobytes()
+        if len(frame) < FRAME_SIZE:
+            # pad the last frame with silence instead of dropping it
+            frame += bytes(FRAME_SIZE - len(frame))
+        return frame
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self._pcm = memoryview(b'')
+        self._pos = 0
+
+
+class OpusEncodingSource(discord.AudioSource):
+    """`AudioSource` encoding the frames of a PCM source into Opus by
+    itself instead of the voice client, so that the time spent on
+    encoding is measured
+
+    If `on_complete` is given, it is called with the packed packets (see
+    `pack_packets`) once the whole source has been encoded, so that the
+    clip can be cached and played again without encoding.
+    """
+
+    def __init__(self, source: discord.AudioSource,
+                 on_complete: Optional[Callable[[bytes], None]] = None):
+        """constructor """
+
+        if source.is_opus():
+            raise ValueError(f'source is already encoded: {source!r}')
+        self.source = source
+        self.on_complete = on_complete
+        self._encoder = discord.opus.Encoder()
+        self._packets = [] if on_complete is not None else None
+
+    @property
+    def duration(self) -> float:
+        """Length of the audio in seconds """
+
+        return self.source.duration
+
+    def read(self) -> bytes:
+        """return next 20ms Opus packet (`b''` at the end) """
+
+        frame = self.source.read()
+        if not frame:
+            if self._packets is not None:
+                packets, self._packets = self._packets, None
+                self.on_complete(pack_packets(packets))
+            return b''
+        start = time.perf_counter()
+        packet = self._encoder.encode(frame, self._encoder.SAMPLES_PER_FRAME)
+        metrics.OPUS_ENCODE_SECONDS.observe(time.perf_counter() - start)
+        if self._packets is not None:
+            self._packets.append(packet)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        # stopped before the end: the clip is incomplete
+        self._packets = None
+        self.source.cleanup()
+
+
+def pack_packets(packets: Iterable[bytes]) -> bytes:
+    """return Opus packets packed into a `bytes` with length prefixes """
+
+    return b''.join(_PACKET_HEADER.pack(len(p)) + p for p in packets)
+
+
+def _ogg_page(packets: Sequence[bytes], header_type: int, granule: int,
+              serial: int, sequence: int) -> bytes:
+    """(internal) return an Ogg page of whole `packets` """
+
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = _OGG_PAGE_HEADER.pack(b'OggS', 0, header_type, granule, serial,
+                                   sequence, 0, len(lacing))
+    page = bytearray(header + lacing + b''.join(packets))
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xffffffff) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    struct.pack_into('<I', page, 22, crc)
+    return bytes(page)
+
+
+def ogg_opus(packets: Sequence[bytes], channels: int = 2,
+             serial: int = 0x6a74616b) -> bytes:
+    """return 20ms 48kHz Opus packets (e.g. of `OpusEncodingSource`) in an
+    Ogg Opus file """
+
+    samples = SAMPLING_RATE * FRAME_LENGTH // 1000
+    head = _OPUS_HEAD.pack(b'OpusHead', 1, channels, OGG_OPUS_PRE_SKIP,
+                           SAMPLING_RATE, 0, 0)
+    tags = b'OpusTags' + struct.pack('<I', len(OGG_OPUS_VENDOR)) \
+        + OGG_OPUS_VENDOR + struct.pack('<I', 0)
+    pages = [_ogg_page([head], 0x02, 0, serial, 0),
+             _ogg_page([tags], 0x00, 0, serial, 1)]
+    if not packets:
+        pages[-1] = _ogg_page([tags], 0x04, 0, serial, 1)
+        return b''.join(pages)
+    # up to 5 lacing values of a packet (<= 1275 bytes) fit in a page
+    for start in range(0, len(packets), OGG_PACKETS_PER_PAGE):
+        chunk = packets[start:start + OGG_PACKETS_PER_PAGE]
+        end = start + len(chunk)
+        granule = OGG_OPUS_PRE_SKIP + end * samples
+        header_type = 0x04 if end == len(packets) else 0x00
+        pages.append(_ogg_page(chunk, header_type, granule, serial, len(pages)))
+    return b''.join(pages)
+
+
+class OpusPacketSource(discord.AudioSource):
+    """`AudioSource` passing through Opus packets packed by
+    `pack_packets` without synthesizing nor encoding """
+
+    def __init__(self, data: bytes):
+        """constructor """
+
+        self._data = memoryview(data)
+        self._pos = 0
+
+    @property
+    def duration(self) -> float:
+        """Length of the audio in seconds """
+
+        count = 0
+        pos = 0
+        while pos + _PACKET_HEADER.size <= len(self._data):
+            size, = _PACKET_HEADER.unpack_from(self._data, pos)
+            pos += _PACKET_HEADER.size + size
+            count += 1
+        return count * FRAME_LENGTH / 1000
+
+    def read(self) -> bytes:
+        """return next 20ms Opus packet (`b''` at the end) """
+
+        pos = self._pos
+        if pos + _PACKET_HEADER.size > len(self._data):
+            return b''
+        size, = _PACKET_HEADER.unpack_from(self._data, pos)
+        pos += _PACKET_HEADER.size
+        self._pos = pos + size
+        return self._data[pos:pos + size].tobytes()
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self._data = memoryview(b'')
+        self._pos = 0
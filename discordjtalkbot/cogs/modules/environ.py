@@ -2,14 +2,47 @@
 
 
 import json
+import logging
 import os
 import sys
 from argparse import ArgumentParser, Namespace
-from typing import (Dict, ItemsView, Iterable, KeysView, Optional, Sequence,
-                    Union, ValuesView)
+from collections import namedtuple
+from typing import (Any, Dict, ItemsView, Iterable, KeysView, NamedTuple,
+                    Optional, Sequence, Tuple, Union, ValuesView)
 
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
 
-FieldValue = Union[str, int, float]
+
+FieldValue = Union[str, int, float, bool, Tuple[str, ...]]
+
+
+def boolean(value: Any) -> bool:
+    """field type converting "True" (or `True`) to `True` and any other
+    value to `False`
+
+    >>> boolean('True'), boolean('False'), boolean(True), boolean('')
+    (True, False, True, False)
+    """
+
+    if isinstance(value, bool):
+        return value
+    return str(value) == 'True'
+
+
+def string_list(value: Any) -> Tuple[str, ...]:
+    """field type splitting a comma separated string into a tuple of
+    non-empty items
+
+    >>> string_list('a, b,,c')
+    ('a', 'b', 'c')
+    >>> string_list('')
+    ()
+    """
+
+    if isinstance(value, (tuple, list)):
+        return tuple(value)
+    return tuple(v for v in (v.strip() for v in str(value).split(',')) if v)
 
 
 class EnvField(object):
@@ -37,6 +70,11 @@ class ApplicationEnvironment(object):
 
         self.fields = {}
         self._dict = {}
+        # loads in order to be replayed by `reload()`
+        self._loads = []
+        self._replaying = False
+        self._fingerprint = None
+        self._snapshot = None
 
     def __contains__(self, item: str) -> bool:
         """return whether the object contains `item` """
@@ -98,6 +136,7 @@ class ApplicationEnvironment(object):
 
         with open(filename, encoding='utf-8') as fp:
             result = json.load(fp)
+        self._record('json', filename)
 
         d = {}
         for name, field in self.fields.items():
@@ -106,7 +145,7 @@ class ApplicationEnvironment(object):
             if value is not None:
                 value = field.type(value)
             d[name] = value
-        self._dict.update(d)
+        self._update(d)
         return d
 
     def load_args(self,
@@ -135,8 +174,9 @@ class ApplicationEnvironment(object):
                                 default=default,
                                 help=field.help)
         namespace = parser.parse_args(args)
+        self._record('args', list(args))
         d = {k: v for k, v in vars(namespace).items() if v is not None}
-        self._dict.update(d)
+        self._update(d)
         return d
 
     def load_env(self,
@@ -153,6 +193,7 @@ class ApplicationEnvironment(object):
         {'a': 1, 'b': 'two'}
         """
 
+        self._record('env', env, prefix)
         if env is None:
             env = os.environ
 
@@ -166,9 +207,123 @@ class ApplicationEnvironment(object):
             if value is not None:
                 value = field.type(value)
             d[name] = value
-        self._dict.update(d)
+        self._update(d)
         return d
 
+    @property
+    def snapshot(self) -> NamedTuple:
+        """Immutable snapshot of all the fields converted by their types,
+        rebuilt only after the settings are loaded
+
+        >>> appenv = ApplicationEnvironment()
+        >>> appenv.add_field('a', type=int, default=1)
+        >>> appenv.add_field('b', type=boolean, default=False)
+        >>> appenv.snapshot
+        Snapshot(a=1, b=False)
+        >>> appenv.load_env({'B': 'True'}).get('b')
+        True
+        >>> appenv.snapshot.b
+        True
+        """
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot._fields != tuple(self.fields):
+            values = []
+            for name, field in self.fields.items():
+                value = self._dict.get(name, field.default)
+                if value is not None:
+                    value = field.type(value)
+                values.append(value)
+            snapshot = _snapshot_type(tuple(self.fields))(*values)
+            self._snapshot = snapshot
+        return snapshot
+
+    def fingerprint(self) -> tuple:
+        """return a value which changes when a loaded JSON file (its
+        mtime or size) or a loaded environment variable changes """
+
+        result = []
+        for kind, *args in self._loads:
+            if kind == 'json':
+                try:
+                    st = os.stat(args[0])
+                    result.append((st.st_mtime_ns, st.st_size))
+                except OSError:
+                    result.append(None)
+            elif kind == 'env':
+                env = os.environ if args[0] is None else args[0]
+                result.append(tuple(env.get(k) for k in self._env_keys(args[1])))
+        return tuple(result)
+
+    def refresh(self) -> bool:
+        """reload the settings if the sources are changed and return
+        whether they are reloaded """
+
+        fingerprint = self.fingerprint()
+        if fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        return self.reload()
+
+    def reload(self) -> bool:
+        """replay all the loads from the defaults and swap in the result
+        (keeping the current settings if any of them fails), and return
+        whether it succeeded """
+
+        old = self._dict
+        self._dict = {}
+        self._replaying = True
+        try:
+            for kind, *args in self._loads:
+                if kind == 'json':
+                    self.load_json(args[0])
+                elif kind == 'args':
+                    self.load_args(args[0])
+                elif kind == 'env':
+                    self.load_env(args[0], args[1])
+        except (OSError, ValueError, SystemExit) as e:
+            LOG.warning(f'failed to reload settings: {e!r}')
+            self._dict = old
+            return False
+        finally:
+            self._replaying = False
+        self._snapshot = None
+        return True
+
+    def _env_keys(self, prefix: str) -> Iterable[str]:
+        """(internal) return names of environment variables for fields """
+
+        for name in self.fields:
+            key = name.upper()
+            yield prefix.upper() + '_' + key if prefix else key
+
+    def _record(self, kind: str, *args):
+        """(internal) remember a load to be replayed """
+
+        if not self._replaying:
+            self._loads.append((kind, *args))
+
+    def _update(self, d: Dict[str, Optional[FieldValue]]):
+        """(internal) update settings and invalidate the snapshot """
+
+        self._dict.update(d)
+        if not self._replaying:
+            self._snapshot = None
+            self._fingerprint = self.fingerprint()
+
+
+_snapshot_types = {}
+
+
+def _snapshot_type(names: Tuple[str, ...]) -> type:
+    """(internal) return the named tuple type of a snapshot of fields """
+
+    result = _snapshot_types.get(names)
+    if result is None:
+        result = namedtuple('Snapshot', names)
+        _snapshot_types[names] = result
+    return result
+
 
 __appenv__ = None
 
@@ -0,0 +1,418 @@
+"""latency and throughput metrics of the reading pipeline
+
+Metrics are kept in process and exposed in Prometheus text format by
+`MetricsServer` (optional) and summarized by the `$stats` command.
+Observations may come from the audio player thread, so every metric is
+guarded by a lock.
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Registry',
+    'LoopLagMonitor',
+    'MetricsServer',
+    'REGISTRY',
+]
+
+
+NAMESPACE = 'discordjtalkbot'
+
+# upper bounds in seconds of per-utterance stages
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0)
+
+# upper bounds in seconds of per-20ms-frame stages
+FRAME_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                 0.01, 0.02)
+
+# seconds between the checks of the event loop lag
+LAG_INTERVAL = 0.5
+
+
+def _format_value(value: float) -> str:
+    """(internal) return `value` formatted for the exposition """
+
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter(object):
+    """monotonically increasing value """
+
+    __slots__ = ['name', 'help', '_value', '_lock']
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        """constructor """
+
+        self.name = name
+        self.help = help
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        """Current value """
+
+        return self._value
+
+    def inc(self, amount: float = 1.0):
+        """increase the value by `amount` """
+
+        with self._lock:
+            self._value += amount
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """return a list of `(name, value)` """
+
+        return [(self.name + '_total', self._value)]
+
+
+class Gauge(object):
+    """value that can go up and down, or be read from a function """
+
+    __slots__ = ['name', 'help', '_value', '_function']
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str):
+        """constructor """
+
+        self.name = name
+        self.help = help
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    @property
+    def value(self) -> float:
+        """Current value """
+
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                LOG.exception(f'failed to read gauge {self.name}')
+                return math.nan
+        return self._value
+
+    def set(self, value: float):
+        """set the value """
+
+        self._value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """read the value from `function` (`None` to stop it) """
+
+        self._function = function
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """return a list of `(name, value)` """
+
+        return [(self.name, self.value)]
+
+
+class Histogram(object):
+    """distribution of observed values in cumulative buckets """
+
+    __slots__ = ['name', 'help', 'buckets', '_counts', '_sum', '_count',
+                 '_lock']
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str,
+                 buckets: Sequence[float] = BUCKETS):
+        """constructor """
+
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        """Number of observations """
+
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        """Sum of observed values """
+
+        return self._sum
+
+    def observe(self, value: float):
+        """record an observation """
+
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """observe seconds elapsed in the `with` block """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> float:
+        """return the upper bound of the bucket containing quantile `q`
+        (`nan` without observations) """
+
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return math.nan
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self) -> List[Tuple[str, float]]:
+        """return a list of `(name, value)` """
+
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+            total = self._count
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            result.append(
+                (f'{self.name}_bucket{{le="{_format_value(bound)}"}}',
+                 cumulative))
+        result.append((self.name + '_sum', total_sum))
+        result.append((self.name + '_count', total))
+        return result
+
+
+class Registry(object):
+    """collection of metrics exposed together """
+
+    def __init__(self):
+        """constructor """
+
+        self._metrics: Dict[str, object] = {}
+
+    def __iter__(self):
+        """return iterator of the registered metrics """
+
+        return iter(list(self._metrics.values()))
+
+    def register(self, metric):
+        """add `metric` (replacing the one of the same name) and return it """
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        """return a new registered counter """
+
+        return self.register(Counter(f'{NAMESPACE}_{name}', help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        """return a new registered gauge """
+
+        return self.register(Gauge(f'{NAMESPACE}_{name}', help))
+
+    def histogram(self, name: str, help: str,
+                  buckets: Sequence[float] = BUCKETS) -> Histogram:
+        """return a new registered histogram """
+
+        return self.register(Histogram(f'{NAMESPACE}_{name}', help, buckets))
+
+    def exposition(self) -> str:
+        """return the metrics in Prometheus text format """
+
+        lines = []
+        for metric in self:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+NORMALIZE_SECONDS = REGISTRY.histogram(
+    'normalize_seconds', 'Seconds to normalize a message.',
+    FRAME_BUCKETS)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'queue_wait_seconds', 'Seconds from queueing an utterance to playing it.')
+SYNTH_SECONDS = REGISTRY.histogram(
+    'synth_seconds', 'Seconds to synthesize an utterance (including cache hits).')
+RESAMPLE_SECONDS = REGISTRY.histogram(
+    'resample_seconds', 'Seconds to upsample an utterance to 48kHz.')
+STEREO_SECONDS = REGISTRY.histogram(
+    'stereo_frame_seconds', 'Seconds to expand a 20ms frame to stereo.',
+    FRAME_BUCKETS)
+OPUS_ENCODE_SECONDS = REGISTRY.histogram(
+    'opus_encode_frame_seconds', 'Seconds to encode a 20ms frame into Opus.',
+    FRAME_BUCKETS)
+PLAYBACK_SECONDS = REGISTRY.histogram(
+    'playback_seconds', 'Seconds to play an utterance.')
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    'event_loop_lag_seconds', 'Delay of the event loop waking up a timer.')
+
+MESSAGES = REGISTRY.counter(
+    'messages', 'Messages queued to be read.')
+UTTERANCES = REGISTRY.counter(
+    'utterances', 'Utterances played.')
+SYNTH_FAILURES = REGISTRY.counter(
+    'synth_failures', 'Utterances failed or rejected to synthesize.')
+COALESCED = REGISTRY.counter(
+    'coalesced', 'Messages merged into a waiting utterance.')
+TRUNCATED = REGISTRY.counter(
+    'truncated', 'Messages truncated at the maximum duration or the latency target.')
+SHED = REGISTRY.counter(
+    'shed', 'Messages dropped not to exceed the latency target.')
+DROPPED = REGISTRY.counter(
+    'dropped', 'Utterances dropped without playing.')
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    'queue_depth', 'Utterances waiting to be played in all the sessions.')
+CACHE_HIT_RATE = REGISTRY.gauge(
+    'cache_hit_rate', 'Hit rate of the synthesized voice cache.')
+OPUS_CACHE_HIT_RATE = REGISTRY.gauge(
+    'opus_cache_hit_rate', 'Hit rate of the pre-encoded Opus clip cache.')
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    'active_sessions', 'Voice reading sessions.')
+BACKLOG_SECONDS = REGISTRY.gauge(
+    'backlog_seconds', 'Estimated seconds of speech queued in the busiest session.')
+SPEEDRATE = REGISTRY.gauge(
+    'speedrate', 'Highest speech rate of the sessions.')
+SYNTH_WAITING = REGISTRY.gauge(
+    'synth_waiting', 'Synthesis jobs waiting for a worker.')
+
+
+class LoopLagMonitor(object):
+    """task measuring how late the event loop wakes up a timer """
+
+    def __init__(self, histogram: Histogram = EVENT_LOOP_LAG_SECONDS,
+                 interval: float = LAG_INTERVAL):
+        """constructor """
+
+        self.histogram = histogram
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """start monitoring (if not started yet) """
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """stop monitoring """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        """(internal) monitor loop """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - start - self.interval)
+            self.histogram.observe(self.last)
+
+
+class MetricsServer(object):
+    """minimal HTTP server exposing a registry at `/metrics` """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, registry: Registry = REGISTRY,
+                 host: str = '127.0.0.1', port: int = 9100):
+        """constructor """
+
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """[Coroutine] start listening (if not started yet) """
+
+        if self._server is None:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port)
+            LOG.info(f'metrics: http://{self.host}:{self.port}/metrics')
+
+    async def close(self):
+        """[Coroutine] stop listening """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        """(internal) respond to a request """
+
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) < 2:
+                # empty (e.g. a TCP health probe) or malformed request line
+                status = '400 Bad Request'
+                body = b'bad request\n'
+            elif parts[0] in ('GET', 'HEAD') \
+                    and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = self.registry.exposition().encode()
+            else:
+                status = '404 Not Found'
+                body = b'not found\n'
+            header = f'HTTP/1.0 {status}\r\n' \
+                f'Content-Type: {self.CONTENT_TYPE}\r\n' \
+                f'Content-Length: {len(body)}\r\n\r\n'
+            writer.write(header.encode())
+            if not parts or parts[0] != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,124 @@
+"""single pass text normalization before reading aloud """
+
+import json
+import logging
+import re
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'RULES',
+    'Normalizer',
+    'load_readings',
+]
+
+
+# (name, pattern, replacement) applied in this order of priority
+RULES = [
+    # URL省略
+    ('url', r'https?://[\w.,~:#%-]+\w+(?:/[\w .,/?%&=~:#-]*)?', 'URL省略'),
+    # ネタバレ削除
+    ('spoiler', r'[|]+.+?[|]+', 'ネタバレ'),
+    # 絵文字無視
+    ('emoji', r'<:\w+:\d+>', '絵文字'),
+    # 改行対策
+    ('newline', r'\n', '。。'),
+]
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """return a regular expression matching any of `words`, factored by
+    common prefixes so that each character is tried against a single
+    branch (longest word wins)
+
+    >>> _trie_pattern(['ab', 'abc', 'b'])
+    '(?:ab(?:c)?|b)'
+    """
+
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(ch) + build(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        pattern = '(?:' + '|'.join(branches) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    return build(trie)
+
+
+class Normalizer(object):
+    """text normalizer replacing URLs, spoilers, custom emojis, newlines
+    and words of the reading dictionary in one scan
+
+    All the rules and the dictionary are compiled into a single regular
+    expression. The dictionary words are compiled as a trie so that
+    adding entries does not slow down matching. The branches are not
+    named groups, which would keep `re` from skipping characters that
+    cannot start any of them; the matched rule is looked up afterwards.
+    """
+
+    def __init__(self,
+                 readings: Optional[Mapping[str, str]] = None,
+                 rules: Sequence[Tuple[str, str, str]] = RULES):
+        """constructor """
+
+        self.rules = list(rules)
+        self.readings = {}
+        self._rules = [(re.compile(pattern), repl)
+                       for _, pattern, repl in self.rules]
+        self._pattern = None
+        self.update_readings(readings or {})
+
+    def update_readings(self, readings: Mapping[str, str]):
+        """add word-to-reading entries and recompile the pattern """
+
+        self.readings.update((w, r) for w, r in readings.items() if w)
+        patterns = [pattern for _, pattern, _ in self.rules]
+        if self.readings:
+            patterns.append(_trie_pattern(self.readings))
+        self._pattern = re.compile('|'.join(patterns))
+
+    def normalize(self, text: str) -> str:
+        """return `text` normalized for reading aloud
+
+        >>> n = Normalizer({'草': 'くさ'})
+        >>> n.normalize('見て||秘密||草\\nhttps://example.com <:wave:123>')
+        '見てネタバレくさ。。URL省略 絵文字'
+        """
+
+        return self._pattern.sub(self._replace, text)
+
+    def _replace(self, m: re.Match) -> str:
+        """(internal) return the replacement of the match """
+
+        matched = m.group()
+        for rule, repl in self._rules:
+            if rule.fullmatch(matched):
+                return repl
+        return self.readings[matched]
+
+
+def load_readings(filename: str) -> Dict[str, str]:
+    """load a reading dictionary (a JSON object of word-to-reading) """
+
+    with open(filename, encoding='utf-8') as fp:
+        result = json.load(fp)
+    if not isinstance(result, dict):
+        raise ValueError(f'reading dictionary must be a JSON object: {filename}')
+    return {str(k): str(v) for k, v in result.items()}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
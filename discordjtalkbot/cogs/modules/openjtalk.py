@@ -1,24 +1,36 @@
 """Open JTalk command wrapper """
 
 import asyncio
+import concurrent.futures
+import importlib.util
 import io
+import multiprocessing
 import os
+import re
 import shlex
 import subprocess
 import sys
-import tempfile
+import threading
+import unicodedata
 import wave
 import logging
 from argparse import ArgumentParser
-from typing import Any, List, Optional, Sequence
+from collections import OrderedDict, deque
+from typing import (Any, Awaitable, BinaryIO, Callable, Hashable, Iterable,
+                    Iterator, List, Optional, Sequence, Tuple, TypeVar, Union)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 logging.basicConfig()
 LOG = logging.getLogger(__name__)
 
 __all__ = [
     'FREQ_44100HZ', 'FREQ_48000HZ',
-    'OpenJTalkError', 'OpenJTalkArgumentParserError',
-    'Agent',
+    'OpenJTalkError', 'OpenJTalkArgumentParserError', 'SynthesisRejected',
+    'WaveCache', 'SynthesisExecutor', 'ResidentEngine', 'AgentConfig', 'Agent',
     'talk', 'async_talk',
 ]
 
@@ -29,12 +41,46 @@ DICT = '/usr/local/opt/open-jtalk/dic' # YOUR_DICT_DIRECTORY
 VOICE = '/usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice' # YOUR_VOICE
 
 WAVE_OUT = 'a.wav'
+# `open_jtalk` writes wave data to the pipe instead of a file
+WAVE_STDOUT = '/dev/stdout'
 TRACE_OUT = 'trace.log'
 
 # pre-defined sampling frequency
 FREQ_44100HZ = 44100
 FREQ_48000HZ = 48000
 
+# default byte budget of `WaveCache`
+CACHE_BYTES = 32 * 1024 * 1024
+
+# default limits of `SynthesisExecutor`
+SYNTH_WORKERS = os.cpu_count() or 1
+SYNTH_QUEUE = 32
+
+# overflow policies of `SynthesisExecutor`
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_MERGE = 'merge'
+OVERFLOW_POLICIES = (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST, OVERFLOW_MERGE)
+
+# synthesis engines
+ENGINE_CLI = 'cli'
+ENGINE_RESIDENT = 'resident'
+ENGINES = (ENGINE_CLI, ENGINE_RESIDENT)
+
+# default maximum length of a chunk returned by `split_sentences`
+CHUNK_CHARS = 80
+
+# rough seconds of speech per character at speedrate 1.0
+SECONDS_PER_CHAR = 0.15
+
+# appended to a text truncated by `truncate_text`
+TRUNCATE_SUFFIX = '以下略'
+_PAUSE_MARKS = tuple('。．！？!?、，,')
+
+_SENTENCE_PATTERN = re.compile(r'[^。．！？!?\n]+[。．！？!?\n]*')
+# a run of commas alone is a phrase too (not to be dropped)
+_PHRASE_PATTERN = re.compile(r'[^、，,]+[、，,]*|[、，,]+')
+
 
 class OpenJTalkError(Exception):
     """module exception """
@@ -46,6 +92,11 @@ class OpenJTalkArgumentParserError(OpenJTalkError):
     pass
 
 
+class SynthesisRejected(OpenJTalkError):
+    """synthesis job rejected or dropped by `SynthesisExecutor` """
+    pass
+
+
 class _OpenJTalkArgumentParser(ArgumentParser):
     """(internal) option parser for `open_jtalk` command """
 
@@ -101,9 +152,428 @@ PROP_NAMES_DICT = {m.name: m for m in OPTION_MAPPINGS}
 OPTIONS_DICT = {m.option: m for m in OPTION_MAPPINGS}
 
 
+def normalize_text(text: str) -> str:
+    """return `text` normalized to be used as a part of a cache key """
+
+    return unicodedata.normalize('NFC', text).strip()
+
+
+class WaveCache(object):
+    """LRU cache of synthesized wave data bounded by the total size in
+    bytes """
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        """constructor """
+
+        max_bytes = int(max_bytes)
+        if max_bytes < 0:
+            raise ValueError(f'max_bytes must be >= 0: {max_bytes}')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """return the number of cached entries """
+
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """return whether `key` is cached (without touching LRU order) """
+
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the cached data in bytes """
+
+        return self._nbytes
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of hits to all lookups (0.0 if never looked up) """
+
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def make_key(text: str, args: Sequence[str], stereo: bool = True
+                 ) -> Tuple[str, Tuple[str, ...], bool]:
+        """return a cache key for `text` spoken with `open_jtalk` args """
+
+        return (normalize_text(text), tuple(args), bool(stereo))
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """return cached data for `key` or `None`, counting hit/miss """
+
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: Hashable, data: bytes):
+        """store `data` for `key`, evicting least recently used entries
+        to keep the total size within `max_bytes` """
+
+        size = len(data)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= len(old)
+            if not data or size > self.max_bytes:
+                return
+            self._entries[key] = data
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def clear(self):
+        """remove all entries and reset the counters """
+
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """return a `dict` of cache statistics """
+
+        return {
+            'entries': len(self._entries),
+            'bytes': self._nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+
+T = TypeVar('T')
+
+
+class SynthesisExecutor(object):
+    """runs synthesis jobs with bounded concurrency
+
+    At most `max_workers` jobs run at once and at most `max_queue` jobs
+    wait for a free worker. When a job is submitted to the full queue,
+    `policy` decides what happens:
+
+    - 'reject': the new job raises `SynthesisRejected`
+    - 'drop_oldest': the oldest waiting job raises `SynthesisRejected`
+      and the new one takes its place
+    - 'merge': a job with the same key as a running or waiting one
+      shares its result (this also applies when the queue is not full),
+      otherwise the new job is rejected; the shared job is cancelled
+      when all the callers waiting for it are cancelled
+    """
+
+    def __init__(self,
+                 max_workers: int = SYNTH_WORKERS,
+                 max_queue: int = SYNTH_QUEUE,
+                 policy: str = OVERFLOW_REJECT):
+        """constructor """
+
+        if max_workers < 1:
+            raise ValueError(f'max_workers must be >= 1: {max_workers}')
+        if max_queue < 0:
+            raise ValueError(f'max_queue must be >= 0: {max_queue}')
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'policy must be one of {OVERFLOW_POLICIES}: {policy!r}')
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.merged = 0
+        self._waiters = deque()
+        self._inflight = {}
+        self._sharers = {}
+
+    @property
+    def waiting(self) -> int:
+        """Number of jobs waiting for a free worker """
+
+        return len(self._waiters)
+
+    def stats(self) -> dict:
+        """return a `dict` of executor statistics """
+
+        return {
+            'running': self.running,
+            'waiting': self.waiting,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'policy': self.policy,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'merged': self.merged,
+        }
+
+    async def submit(self, job: Callable[[], Awaitable[T]],
+                     key: Optional[Hashable] = None) -> T:
+        """[Coroutine] run `job()` when a worker is free and return its
+        result; `key` identifies identical jobs for the 'merge' policy """
+
+        if self.policy == OVERFLOW_MERGE and key is not None:
+            task = self._inflight.get(key)
+            if task is not None:
+                self.merged += 1
+            else:
+                task = asyncio.ensure_future(self._run(job))
+                self._inflight[key] = task
+                task.add_done_callback(
+                    lambda t: self._inflight.pop(key, None)
+                    if self._inflight.get(key) is t else None)
+            return await self._share(key, task)
+        return await self._run(job)
+
+    async def _share(self, key: Hashable, task: asyncio.Future):
+        """(internal) wait for the merged `task`, cancelling it (and
+        killing its process) when all the callers waiting for it are
+        cancelled """
+
+        self._sharers[task] = self._sharers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._sharers[task] -= 1
+            if not self._sharers[task]:
+                del self._sharers[task]
+                if not task.done():
+                    # no one waits for the result any more
+                    if self._inflight.get(key) is task:
+                        del self._inflight[key]
+                    task.cancel()
+
+    async def _run(self, job: Callable[[], Awaitable[T]]) -> T:
+        """(internal) wait for a worker and run `job` """
+
+        await self._acquire()
+        try:
+            return await job()
+        finally:
+            self.completed += 1
+            self._release()
+
+    async def _acquire(self):
+        """(internal) wait until a worker is assigned to the caller """
+
+        if self.running < self.max_workers and not self._waiters:
+            self.running += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            if self.policy == OVERFLOW_DROP_OLDEST and self._waiters:
+                oldest = self._waiters.popleft()
+                oldest.set_exception(SynthesisRejected('dropped from the synthesis queue'))
+                self.dropped += 1
+            else:
+                self.rejected += 1
+                raise SynthesisRejected('synthesis queue is full')
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # the worker is handed over by `_release()`
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled() \
+                    and waiter.exception() is None:
+                self._release()
+            raise
+
+    def _release(self):
+        """(internal) hand the worker over to the next waiter or free it """
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+
+default_executor = SynthesisExecutor()
+
+
+# options `ResidentEngine` can apply
+RESIDENT_OPTIONS = ('dictionary', 'voice', 'speedrate', 'halftone', 'volume')
+
+# (worker process) frontend and HTS engines loaded by `_resident_init`
+_resident_jtalk = None
+_resident_voices = {}
+
+
+def _resident_init(dictionary: str):
+    """(internal) initialize a worker process of `ResidentEngine` """
+
+    global _resident_jtalk
+    from pyopenjtalk.openjtalk import OpenJTalk
+    _resident_jtalk = OpenJTalk(dn_mecab=dictionary.encode(ENCODING))
+
+
+def _resident_synthesize(text: str, voice: str, speedrate: Optional[float],
+                         halftone: Optional[float], volume: Optional[float]
+                         ) -> bytes:
+    """(internal) synthesize `text` in a worker process of `ResidentEngine`
+    and return monaural wave data """
+
+    from pyopenjtalk.htsengine import HTSEngine
+
+    engine = _resident_voices.get(voice)
+    if engine is None:
+        engine = HTSEngine(voice.encode(ENCODING))
+        _resident_voices[voice] = engine
+    engine.set_speed(1.0 if speedrate is None else speedrate)
+    engine.add_half_tone(0.0 if halftone is None else halftone)
+
+    labels = _resident_jtalk.make_label(_resident_jtalk.run_frontend(text))
+    speech = engine.synthesize(labels)
+    if volume:
+        speech *= 10.0 ** (volume / 20.0)
+    pcm = np.clip(speech, -32768, 32767).astype('<i2').tobytes()
+
+    with io.BytesIO() as stream:
+        with wave.open(stream, 'wb') as wo:
+            wo.setnchannels(1)
+            wo.setsampwidth(2)
+            wo.setframerate(engine.get_sampling_frequency())
+            wo.writeframes(pcm)
+        return stream.getvalue()
+
+
+class ResidentEngine(object):
+    """Open JTalk engine kept resident in worker processes
+
+    Each worker process loads the dictionary once and every HTS voice
+    once on its first use with `pyopenjtalk`, and texts are sent to the
+    workers over pipes instead of spawning `open_jtalk` for every
+    utterance. Options other than `RESIDENT_OPTIONS` are ignored.
+    """
+
+    def __init__(self, dictionary: str, max_workers: int = SYNTH_WORKERS):
+        """constructor """
+
+        if importlib.util.find_spec('pyopenjtalk') is None or np is None:
+            raise OpenJTalkError('resident engine requires pyopenjtalk and numpy')
+        self.dictionary = dictionary
+        self.max_workers = max_workers
+        self._ignored = set()
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_resident_init,
+            initargs=(dictionary,))
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} at {hex(id(self))}' \
+            + f' {self.dictionary} x{self.max_workers}>'
+
+    def synthesize(self, text: str, options: dict) -> bytes:
+        """return monaural wave data for `text` spoken with `options` (a
+        `dict` of `Agent` option values) """
+
+        return self._submit(text, options).result()
+
+    async def async_synthesize(self, text: str, options: dict) -> bytes:
+        """[Coroutine] return monaural wave data for `text` spoken with
+        `options` (a `dict` of `Agent` option values) """
+
+        return await asyncio.wrap_future(self._submit(text, options))
+
+    def shutdown(self, wait: bool = True):
+        """terminate the worker processes """
+
+        self._pool.shutdown(wait=wait)
+
+    def _submit(self, text: str, options: dict) -> concurrent.futures.Future:
+        """(internal) submit a synthesis job to the workers """
+
+        if options.get('dictionary', self.dictionary) != self.dictionary:
+            raise OpenJTalkError(f'dictionary is fixed to {self.dictionary}')
+        for k, v in options.items():
+            if v is not None and k not in RESIDENT_OPTIONS \
+                    and k not in self._ignored:
+                self._ignored.add(k)
+                LOG.warning(f'{k!r} is ignored by the resident engine')
+        return self._pool.submit(
+            _resident_synthesize, text, options['voice'],
+            options.get('speedrate'), options.get('halftone'),
+            options.get('volume'))
+
+
+class AgentConfig(object):
+    """frozen option set of an `Agent` for a voice, with the command line
+    args computed once
+
+    Synthesis reads everything from the config given to it instead of
+    the shared agent, so utterances of different voices are rendered in
+    parallel safely.
+    """
+
+    __slots__ = ['options', 'args', 'argv']
+
+    def __init__(self, options: dict):
+        """constructor """
+
+        args = []
+        for prop_name, value in options.items():
+            if value is None or prop_name not in PROP_NAMES_DICT:
+                continue
+            args.append(PROP_NAMES_DICT[prop_name].option)
+            args.append(str(value))
+        set_ = super().__setattr__
+        set_('options', tuple(options.items()))
+        set_('args', tuple(args))
+        set_('argv', (OPEN_JTALK,) + tuple(args) + ('-ow', WAVE_STDOUT))
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} [{shlex.join(self.args)}]>'
+
+    @property
+    def voice(self) -> str:
+        """Path to the HTS voice file """
+
+        return dict(self.options)['voice']
+
+    def cache_key(self, text: str, stereo: bool = True) -> Hashable:
+        """return the cache key for `text` spoken with this config """
+
+        return WaveCache.make_key(text, self.args, stereo)
+
+
 class Agent(object):
     """Open JTalk command line option set """
 
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        if name in PROP_NAMES_DICT:
+            # options changed: the configs computed so far are stale
+            super().__setattr__('_configs', {})
+
     @property
     def dictionary(self) -> str:
         """Path to the dictionary directory """
@@ -316,7 +786,10 @@ class Agent(object):
             spectrum: float = None,
             logf0: float = None,
             volume: float = None,
-            buffersize: int = None):
+            buffersize: int = None,
+            cache: Optional[WaveCache] = None,
+            executor: Optional[SynthesisExecutor] = None,
+            engine: Optional[ResidentEngine] = None):
         """Constructor. """
 
         self.dictionary = dictionary
@@ -333,6 +806,9 @@ class Agent(object):
         self.logf0 = logf0
         self.volume = volume
         self.buffersize = buffersize
+        self.cache = cache
+        self.executor = executor
+        self.engine = engine
 
     def __repr__(self) -> str:
         """return `repr(self)` """
@@ -364,46 +840,220 @@ class Agent(object):
             args.append(infile)
         return args
 
+    def config(self, **kwds) -> AgentConfig:
+        """return the frozen config of the options overridden by `kwds`
+        (e.g. `voice`), computed once for each distinct `kwds` """
+
+        key = tuple(sorted(kwds.items()))
+        config = self._configs.get(key)
+        if config is None:
+            for k in kwds:
+                if k not in PROP_NAMES_DICT:
+                    raise ValueError(f'{k!r} is not a valid keyword')
+            config = AgentConfig(self._options(kwds))
+            self._configs[key] = config
+        return config
+
     def build_flags(self, **kwds) -> str:
         """return option flags string for `open_jtalk` command """
 
         args = self.build_args(**kwds)
         return shlex.join(args)
 
-    def talk(self, text: str, **kwds) -> bytes:
-        """Retrun wave data bytes for given text """
+    def talk(self, text: str, *, stereo: bool = True, **kwds) -> bytes:
+        """Retrun wave data bytes for given text
+
+        If `stereo` is false, return the monaural wave data as it is
+        output by `open_jtalk`.
+        """
         LOG.info('talk')
 
-        for k in kwds:
-            if k not in PROP_NAMES_DICT:
-                raise ValueError(f'{k!r} is not a valid keyword')
-
-        with tempfile.TemporaryDirectory() as tempdir:
-            output = os.path.join(tempdir, WAVE_OUT)
-            args = [OPEN_JTALK] \
-                 + self.build_args(outwave=output, **kwds)
-            proc = subprocess.run(args, input=text.encode(ENCODING))
-            if proc.returncode == 0:
-                return mono_to_stereo(output)
-        return b''
-
-    async def async_talk(self, text: str, **kwds) -> bytes:
-        """[Coroutine] Retrun wave data bytes for given text """
-
-        for k in kwds:
-            if k not in PROP_NAMES_DICT:
-                raise ValueError(f'{k!r} is not a valid keyword')
-
-        with tempfile.TemporaryDirectory() as tempdir:
-            output = os.path.join(tempdir, WAVE_OUT)
-            args = [OPEN_JTALK] \
-                 + self.build_args(outwave=output, **kwds)
-            proc = await asyncio.create_subprocess_exec(
-                *args, stdin=asyncio.subprocess.PIPE)
-            await proc.communicate(text.encode(ENCODING))
-            if proc.returncode == 0:
-                return mono_to_stereo(output)
-        return b''
+        config = self.config(**kwds)
+        key = self._cache_key(text, config, stereo)
+        if key is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                LOG.debug(f'cache hit: {text!r}')
+                return data
+
+        data = self._synthesize(text, config, stereo)
+        if key is not None:
+            self.cache.put(key, data)
+        return data
+
+    def talk_many(self, texts: Iterable[str], *, stereo: bool = True,
+                  max_workers: Optional[int] = None, **kwds
+                  ) -> Iterator[Tuple[int, bytes]]:
+        """Yield `(index, wave data)` for each of `texts` as soon as it is
+        generated
+
+        Texts are synthesized in parallel by up to `max_workers` worker
+        processes: `open_jtalk` processes, or those of the resident
+        engine (its number of workers by default). Results are yielded
+        in the order of completion, cached ones first.
+        """
+
+        config = self.config(**kwds)
+        if max_workers is None:
+            max_workers = self.engine.max_workers if self.engine is not None \
+                else SYNTH_WORKERS
+        pending = {}
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        try:
+            for i, text in enumerate(texts):
+                key = self._cache_key(text, config, stereo)
+                data = self.cache.get(key) if key is not None else None
+                if data is not None:
+                    yield i, data
+                    continue
+                future = pool.submit(self._synthesize_cached, text, config,
+                                     stereo, key)
+                pending[future] = i
+            for future in concurrent.futures.as_completed(pending):
+                i = pending.pop(future)
+                yield i, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def talk_stream(self, texts: Iterable[str], *, stereo: bool = True,
+                    readahead: Optional[int] = None, **kwds
+                    ) -> Iterator[bytes]:
+        """Yield wave data for each of `texts` in order, synthesizing up
+        to `readahead` following texts in the background meanwhile
+
+        The first one is yielded as soon as it is generated, so that the
+        caller can start playing it while the rest are synthesized.
+        `readahead` defaults to the number of workers as `talk_many`.
+        """
+
+        config = self.config(**kwds)
+        if readahead is None:
+            readahead = self.engine.max_workers if self.engine is not None \
+                else SYNTH_WORKERS
+        ahead = deque()
+        pool = concurrent.futures.ThreadPoolExecutor(readahead + 1)
+        try:
+            for text in texts:
+                ahead.append(self._submit_cached(pool, text, config, stereo))
+                if len(ahead) > readahead:
+                    yield self._result_cached(*ahead.popleft())
+            while ahead:
+                yield self._result_cached(*ahead.popleft())
+        finally:
+            for _, future in ahead:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def _synthesize_cached(self, text: str, config: AgentConfig,
+                           stereo: bool, key: Optional[Hashable]) -> bytes:
+        """(internal) synthesize `text` and put it into the cache with
+        `key` (unless `None`) """
+
+        data = self._synthesize(text, config, stereo)
+        if key is not None:
+            self.cache.put(key, data)
+        return data
+
+    def _submit_cached(self, pool: concurrent.futures.Executor, text: str,
+                       config: AgentConfig, stereo: bool
+                       ) -> Tuple[Optional[Hashable], concurrent.futures.Future]:
+        """(internal) return the cache key and a future of wave data for
+        `text`, already done if cached """
+
+        key = self._cache_key(text, config, stereo)
+        data = self.cache.get(key) if key is not None else None
+        if data is not None:
+            future = concurrent.futures.Future()
+            future.set_result(data)
+            return None, future
+        return key, pool.submit(self._synthesize, text, config, stereo)
+
+    def _result_cached(self, key: Optional[Hashable],
+                       future: concurrent.futures.Future) -> bytes:
+        """(internal) wait for `future` and put its result into the cache
+        with `key` (unless `None`) """
+
+        data = future.result()
+        if key is not None:
+            self.cache.put(key, data)
+        return data
+
+    async def async_talk(self, text: str, *, stereo: bool = True, **kwds) -> bytes:
+        """[Coroutine] Retrun wave data bytes for given text
+
+        If `stereo` is false, return the monaural wave data as it is
+        output by `open_jtalk`.
+        """
+
+        config = self.config(**kwds)
+        key = self._cache_key(text, config, stereo)
+        if key is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                LOG.debug(f'cache hit: {text!r}')
+                return data
+
+        executor = self.executor if self.executor is not None \
+            else default_executor
+        data = await executor.submit(
+            lambda: self._async_synthesize(text, stereo, config),
+            key=config.cache_key(text, stereo))
+        if key is not None:
+            self.cache.put(key, data)
+        return data
+
+    def _synthesize(self, text: str, config: AgentConfig, stereo: bool
+                    ) -> bytes:
+        """(internal) run the engine or `open_jtalk` and return wave data """
+
+        if self.engine is not None:
+            data = self.engine.synthesize(text, dict(config.options))
+        else:
+            proc = subprocess.run(config.argv, input=text.encode(ENCODING),
+                                  stdout=subprocess.PIPE)
+            data = proc.stdout if proc.returncode == 0 else b''
+        return _output_wave(data, stereo)
+
+    async def _async_synthesize(self, text: str, stereo: bool,
+                                config: AgentConfig) -> bytes:
+        """(internal) [Coroutine] run the engine or `open_jtalk` and return
+        wave data """
+
+        if self.engine is not None:
+            data = await self.engine.async_synthesize(text, dict(config.options))
+            return _output_wave(data, stereo)
+
+        proc = await asyncio.create_subprocess_exec(
+            *config.argv, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE)
+        try:
+            data, _ = await proc.communicate(text.encode(ENCODING))
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            return b''
+        return _output_wave(data, stereo)
+
+    def _options(self, kwds: dict) -> dict:
+        """(internal) return a `dict` of the option values overridden by
+        `kwds` """
+
+        d = {k: getattr(self, k) for k in PROP_NAMES_DICT}
+        d.update(kwds)
+        return d
+
+    def _cache_key(self, text: str, config: AgentConfig, stereo: bool
+                   ) -> Optional[Hashable]:
+        """(internal) return the cache key for `text` or `None` if the
+        agent has no cache """
+
+        if self.cache is None:
+            return None
+        return config.cache_key(text, stereo)
 
     @classmethod
     def from_args(cls, args: Sequence[str]) -> 'Agent':
@@ -441,22 +1091,146 @@ async def async_talk(text: str, **kwds) -> bytes:
     return await default_agent.async_talk(text, **kwds)
 
 
-def mono_to_stereo(file: str) -> bytes:
+def split_sentences(text: str, max_chars: int = CHUNK_CHARS) -> List[str]:
+    """split `text` into chunks at the ends of sentences
+
+    The first chunk is a single sentence so that it can be synthesized
+    quickly; the following sentences are joined up to `max_chars`
+    characters. A sentence longer than `max_chars` is split at commas,
+    or every `max_chars` characters if still too long. `max_chars` of 0
+    disables splitting.
+
+    >>> split_sentences('おはよう。。今日は晴れ。明日は雨！', 12)
+    ['おはよう。。', '今日は晴れ。明日は雨！']
+    >>> split_sentences('、、、、、', 2)
+    ['、、', '、、', '、']
+    """
+
+    if max_chars <= 0:
+        return [text] if text.strip() else []
+
+    sentences = []
+    for m in _SENTENCE_PATTERN.finditer(text):
+        sentence = m.group()
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+        else:
+            phrases = (p.group() for p in _PHRASE_PATTERN.finditer(sentence))
+            sentences.extend(_join_pieces(phrases, max_chars))
+
+    chunks = sentences[:1] + _join_pieces(sentences[1:], max_chars)
+    return [c for c in chunks if c.strip()]
+
+
+def estimate_seconds(text: str, speedrate: Optional[float] = None) -> float:
+    """return the rough duration in seconds of `text` read at `speedrate`
+    estimated from the number of characters (except spaces) """
+
+    chars = len(text) - sum(1 for c in text if c.isspace())
+    return chars * SECONDS_PER_CHAR / (speedrate or 1.0)
+
+
+def truncate_text(text: str, max_seconds: float,
+                  speedrate: Optional[float] = None,
+                  suffix: str = TRUNCATE_SUFFIX) -> str:
+    """return `text` cut to be read within about `max_seconds` at
+    `speedrate` followed by `suffix` (or `text` itself if short enough)
+
+    It is cut at the end of the last sentence or phrase that fits in,
+    unless that drops more than half of the characters allowed. If not
+    even a character fits in besides `suffix`, an empty string is
+    returned.
+
+    >>> truncate_text('おはよう。今日は晴れ。明日は雨！', 1.6)
+    'おはよう。以下略'
+    >>> truncate_text('今日はいい天気ですね', 1.0)
+    '今日は、以下略'
+    >>> truncate_text('今日はいい天気ですね', 0.5)
+    ''
+    """
+
+    if estimate_seconds(text, speedrate) <= max_seconds:
+        return text
+    limit = int(max_seconds * (speedrate or 1.0) / SECONDS_PER_CHAR) - len(suffix)
+    if limit <= 0:
+        return ''
+    head = text[:limit]
+    # 文や読点の区切りで切る
+    m = re.match(r'.*[。．！？!?\n、，,]', head, re.DOTALL)
+    if m and len(m.group()) * 2 >= limit:
+        head = m.group()
+    head = head.rstrip()
+    if head and not head.endswith(_PAUSE_MARKS):
+        head += '、'
+    return head + suffix
+
+
+def _join_pieces(pieces, max_chars: int) -> List[str]:
+    """(internal) join `pieces` greedily into strings of at most
+    `max_chars` characters """
+
+    chunks = []
+    buf = ''
+    for piece in pieces:
+        while len(piece) > max_chars:
+            if buf:
+                chunks.append(buf)
+                buf = ''
+            chunks.append(piece[:max_chars])
+            piece = piece[max_chars:]
+        if len(buf) + len(piece) > max_chars:
+            chunks.append(buf)
+            buf = ''
+        buf += piece
+    if buf:
+        chunks.append(buf)
+    return chunks
+
+
+def _output_wave(data: bytes, stereo: bool) -> bytes:
+    """(internal) return monaural wave data `data`, stereo converted if
+    `stereo` is true """
+
+    if not data or not stereo:
+        return data
+    return mono_to_stereo(io.BytesIO(data))
+
+
+def mono_to_stereo(file: Union[str, BinaryIO]) -> bytes:
     """Return stereo converted wave data from a monaural wave file. """
 
     with io.BytesIO() as stream, \
     wave.open(file, 'rb') as wi, \
     wave.open(stream, 'wb') as wo:
+        sampwidth = wi.getsampwidth()
         wo.setnchannels(2)
-        wo.setsampwidth(wi.getsampwidth())
+        wo.setsampwidth(sampwidth)
         wo.setframerate(wi.getframerate())
         nframes = wi.getnframes()
         wo.setnframes(nframes)
-        gen_frames = (wi.readframes(1) for _ in range(nframes))
-        [wo.writeframesraw(f * 2) for f in gen_frames]
+        frames = wi.readframes(nframes)
+        wo.writeframesraw(mono_to_stereo_frames(frames, sampwidth))
         return stream.getvalue()
 
 
+def mono_to_stereo_frames(frames: bytes, sampwidth: int) -> bytes:
+    """Return stereo PCM data in which each sample of monaural PCM data
+    `frames` is duplicated to the left and right channels """
+
+    if np is not None:
+        samples = np.frombuffer(frames, dtype=f'V{sampwidth}')
+        return np.repeat(samples, 2).tobytes()
+
+    # interleave byte columns with extended slices (no per-sample loop)
+    out = bytearray(len(frames) * 2)
+    step = sampwidth * 2
+    for i in range(sampwidth):
+        column = frames[i::sampwidth]
+        out[i::step] = column
+        out[sampwidth + i::step] = column
+    return bytes(out)
+
+
 _parser = None
 
 def parse_args(args: Sequence[str]) -> dict:
@@ -0,0 +1,179 @@
+"""files read into the page cache ahead of use and optionally locked in
+memory """
+
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import os
+import time
+from typing import Iterable, List, Optional
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'ResidentFiles',
+    'list_files',
+]
+
+
+PAGE_SIZE = mmap.PAGESIZE
+
+# `mmap(2)` flags (the same values on Linux and macOS)
+_PROT_READ = 0x1
+_MAP_SHARED = 0x1
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+def list_files(paths: Iterable[str]) -> List[str]:
+    """return the regular files of `paths`, those under directories
+    included, without duplicates (missing ones are skipped) """
+
+    files = {}
+    for path in paths:
+        if not path:
+            continue
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    files[os.path.join(root, name)] = None
+        elif os.path.isfile(path):
+            files[path] = None
+        else:
+            LOG.warning(f'not found: {path}')
+    return list(files)
+
+
+def _libc() -> Optional[ctypes.CDLL]:
+    """(internal) return the C library providing `mmap` and `mlock` or
+    `None` """
+
+    name = ctypes.util.find_library('c')
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.mmap, libc.munmap, libc.mlock, libc.munlock
+    except (OSError, AttributeError):
+        return None
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                          ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = libc.mlock.argtypes = libc.munlock.argtypes = \
+        [ctypes.c_void_p, ctypes.c_size_t]
+    return libc
+
+
+class _LockedMap(object):
+    """(internal) read-only shared mapping of a file locked in memory """
+
+    __slots__ = ['addr', 'size']
+
+    def __init__(self, addr: int, size: int):
+        """constructor """
+
+        self.addr = addr
+        self.size = size
+
+
+class ResidentFiles(object):
+    """files read into the page cache so that the first `open_jtalk` runs
+    do not wait for the storage
+
+    Each file is mapped and touched page by page. With `lock`, the
+    mappings are kept and locked with `mlock` until `release` so that
+    the pages are not evicted; otherwise they stay in the page cache only
+    as long as the kernel keeps them. Locking needs `CAP_IPC_LOCK` or a
+    large enough `RLIMIT_MEMLOCK` (`ulimit -l`); if it fails, the rest
+    of the files are only read.
+    """
+
+    def __init__(self, paths: Iterable[str], *, lock: bool = False):
+        """constructor """
+
+        self.paths = list(paths)
+        self.lock = lock
+        self.files = 0
+        self.nbytes = 0
+        self.locked_bytes = 0
+        self.seconds = 0.0
+        self._locked: List[_LockedMap] = []
+        self._libc = None
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} {self.files} files' \
+            + f' {self.nbytes} bytes ({self.locked_bytes} locked)' \
+            + f' in {self.seconds:.2f}s>'
+
+    def load(self) -> 'ResidentFiles':
+        """read the files into the page cache (and lock them) and return
+        `self` """
+
+        start = time.perf_counter()
+        lock = self.lock
+        if lock:
+            self._libc = _libc()
+            if self._libc is None:
+                LOG.warning('mlock is not available, files are only read.')
+                lock = False
+        for path in list_files(self.paths):
+            try:
+                size = os.path.getsize(path)
+                if size == 0:
+                    continue
+                with open(path, 'rb') as f:
+                    if lock:
+                        lock = self._lock_file(f, size, path)
+                    if not lock:
+                        self._read_file(f, size)
+            except OSError as e:
+                LOG.warning(f'failed to read {path}: {e}')
+                continue
+            self.files += 1
+            self.nbytes += size
+        self.seconds = time.perf_counter() - start
+        return self
+
+    def release(self):
+        """unlock and unmap the locked files """
+
+        for locked in self._locked:
+            self._libc.munlock(locked.addr, locked.size)
+            self._libc.munmap(locked.addr, locked.size)
+        self._locked.clear()
+        self.locked_bytes = 0
+
+    @staticmethod
+    def _read_file(f, size: int):
+        """(internal) read the pages of an open file into the page cache """
+
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_WILLNEED)
+            # touch a byte of every page
+            with memoryview(mm) as view:
+                bytes(view[::PAGE_SIZE])
+
+    def _lock_file(self, f, size: int, path: str) -> bool:
+        """(internal) map an open file and lock it in memory, and return
+        whether it succeeded """
+
+        # a read-only shared mapping locks the page cache pages themselves
+        # (a writable private one would be copied into anonymous memory)
+        libc = self._libc
+        addr = libc.mmap(None, size, _PROT_READ, _MAP_SHARED, f.fileno(), 0)
+        if addr is None or addr == _MAP_FAILED:
+            errno = ctypes.get_errno()
+            LOG.warning(f'failed to map {path}: {os.strerror(errno)},'
+                        ' the rest of the files are only read.')
+            return False
+        if libc.mlock(addr, size) != 0:
+            errno = ctypes.get_errno()
+            libc.munmap(addr, size)
+            LOG.warning(f'failed to lock {path}: {os.strerror(errno)},'
+                        ' the rest of the files are only read.')
+            return False
+        self._locked.append(_LockedMap(addr, size))
+        self.locked_bytes += size
+        return True
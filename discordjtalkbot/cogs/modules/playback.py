@@ -0,0 +1,318 @@
+"""event driven playback queue with read-ahead synthesis """
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import discord
+
+from . import metrics
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'PlaybackItem',
+    'PlaybackQueue',
+]
+
+
+# seconds to wait for the voice client to be connected
+CONNECT_TIMEOUT = 6.0
+
+# number of queued items synthesized ahead of the playing one
+READAHEAD = 1
+
+# separator of messages merged into an item
+COALESCE_SEPARATOR = '。'
+
+
+class PlaybackItem(object):
+    """utterance in a `PlaybackQueue` """
+
+    __slots__ = ['text', 'voice', 'group', 'channel', 'seconds',
+                 'enqueued_at', 'updated_at', 'task', 'discarded']
+
+    def __init__(self, text: str, voice: str, group: int = 0,
+                 channel: Optional[int] = None, seconds: float = 0.0):
+        """constructor """
+
+        self.text = text
+        self.voice = voice
+        self.group = group
+        self.channel = channel
+        self.seconds = seconds
+        self.enqueued_at = time.monotonic()
+        self.updated_at = self.enqueued_at
+        self.task: Optional[asyncio.Task] = None
+        self.discarded = False
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} {self.text!r}>'
+
+    def cancel(self):
+        """discard the item and cancel its synthesis (if in progress) """
+
+        self.discarded = True
+        if self.task is not None:
+            self.task.cancel()
+
+
+Render = Callable[[PlaybackItem], Awaitable[Optional[discord.AudioSource]]]
+Estimate = Callable[[str], float]
+
+
+class PlaybackQueue(object):
+    """FIFO playback queue of a voice client
+
+    Items are rendered into audio sources by `render` up to `readahead`
+    items ahead, and played one after another: the next one is started
+    from the `after` callback of `VoiceClient.play` instead of polling.
+    Chunks of a message queued together by `extend` are rendered
+    concurrently as soon as the first of them comes to the head.
+
+    If `coalesce` (seconds) is positive, a one-chunk message from the
+    same channel with the same voice as the last waiting item, queued
+    within `coalesce` seconds after it and before its rendering starts
+    (i.e. while the queue is busy), is merged into that item up to
+    `max_chars` characters, so that a burst is synthesized and played at
+    once.
+
+    `estimate` returns the estimated seconds of a text to sum up the
+    `backlog`.
+    """
+
+    def __init__(
+            self,
+            render: Render,
+            get_voice_client: Callable[[], Optional[discord.VoiceClient]],
+            *,
+            readahead: int = READAHEAD,
+            coalesce: float = 0.0,
+            max_chars: int = 0,
+            estimate: Optional[Estimate] = None):
+        """constructor """
+
+        if readahead < 1:
+            raise ValueError(f'readahead must be >= 1: {readahead}')
+        self.render = render
+        self.get_voice_client = get_voice_client
+        self.readahead = readahead
+        self.coalesce = coalesce
+        self.max_chars = max_chars
+        self.estimate = estimate
+        self._items = deque()
+        self._playing: Optional[PlaybackItem] = None
+        self._playing_since = 0.0
+        self._groups = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._player: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        """return the number of items waiting to be played """
+
+        return len(self._items)
+
+    def backlog(self) -> float:
+        """return the estimated seconds until the queued items are all
+        played """
+
+        seconds = sum(item.seconds for item in self._items)
+        if self._playing is not None:
+            elapsed = time.monotonic() - self._playing_since
+            seconds += max(0.0, self._playing.seconds - elapsed)
+        return seconds
+
+    def put(self, text: str, voice: str, channel: Optional[int] = None
+            ) -> PlaybackItem:
+        """append an utterance to the queue """
+
+        return self.extend([text], voice, channel)[0]
+
+    def extend(self, texts: Sequence[str], voice: str,
+               channel: Optional[int] = None) -> List[PlaybackItem]:
+        """append chunks of a message to the queue (or merge a one-chunk
+        message into the last item, see `coalesce`) """
+
+        if len(texts) == 1 and self._merge(texts[0], voice, channel):
+            return [self._items[-1]]
+        group = next(self._groups)
+        items = [PlaybackItem(text, voice, group, channel, self._estimate(text))
+                 for text in texts]
+        self._items.extend(items)
+        self._prefetch()
+        self._wakeup.set()
+        if self._player is None or self._player.done():
+            self._player = asyncio.ensure_future(self._run())
+        return items
+
+    def clear(self):
+        """discard all the items waiting to be played """
+
+        while self._items:
+            self._items.popleft().cancel()
+
+    def stop(self) -> bool:
+        """discard waiting items, stop playing and return whether it was
+        playing """
+
+        self.clear()
+        vcl = self.get_voice_client()
+        if vcl and vcl.is_playing():
+            vcl.stop()
+            return True
+        return False
+
+    async def close(self):
+        """stop playing and the player task """
+
+        self._closing = True
+        try:
+            self.stop()
+            if self._player is not None:
+                self._player.cancel()
+                try:
+                    await self._player
+                except asyncio.CancelledError:
+                    pass
+                self._player = None
+        finally:
+            self._closing = False
+
+    def _merge(self, text: str, voice: str, channel: Optional[int]) -> bool:
+        """(internal) merge `text` into the last item if possible and
+        return whether it is merged """
+
+        if self.coalesce <= 0 or not self._items:
+            return False
+        tail = self._items[-1]
+        now = time.monotonic()
+        merged = tail.text + COALESCE_SEPARATOR + text
+        if tail.task is not None or tail.discarded \
+                or tail.channel is None or tail.channel != channel \
+                or tail.voice != voice \
+                or now - tail.updated_at > self.coalesce \
+                or (self.max_chars > 0 and len(merged) > self.max_chars):
+            return False
+        tail.text = merged
+        tail.seconds = self._estimate(merged)
+        tail.updated_at = now
+        metrics.COALESCED.inc()
+        return True
+
+    def _estimate(self, text: str) -> float:
+        """(internal) return the estimated seconds of `text` """
+
+        return self.estimate(text) if self.estimate is not None else 0.0
+
+    def _prefetch(self):
+        """(internal) start rendering the first `readahead` items and the
+        rest of the message at the head """
+
+        if not self._items:
+            return
+        head_group = self._items[0].group
+        for i, item in enumerate(self._items):
+            if i >= self.readahead and item.group != head_group:
+                break
+            if item.task is None:
+                item.task = asyncio.ensure_future(self.render(item))
+
+    async def _wait_connected(self) -> Optional[discord.VoiceClient]:
+        """(internal) return the voice client once it is connected or
+        `None` on timeout """
+
+        sleeptime = 0.1
+        for _ in range(int(CONNECT_TIMEOUT / sleeptime)):
+            vcl = self.get_voice_client()
+            if vcl and vcl.is_connected():
+                return vcl
+            await asyncio.sleep(sleeptime)
+        return None
+
+    async def _run(self):
+        """(internal) player loop
+
+        Cancelling the player task while an item is rendered stops the
+        loop (only the cancellation of a discarded item is skipped):
+
+        >>> async def render(item):
+        ...     await asyncio.sleep(60)
+        >>> async def cancel_while_rendering():
+        ...     queue = PlaybackQueue(render, lambda: None)
+        ...     queue.put('こんにちは', 'voice')
+        ...     await asyncio.sleep(0.01)
+        ...     queue._player.cancel()
+        ...     await asyncio.wait([queue._player], timeout=1.0)
+        ...     return queue._player.cancelled()
+        >>> asyncio.run(cancel_while_rendering())
+        True
+        """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            while not self._items:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            item = self._items[0]
+            self._prefetch()
+            try:
+                source = await item.task
+            except asyncio.CancelledError:
+                if not item.discarded or self._closing:
+                    # the player task itself is cancelled
+                    raise
+                # the item is discarded by `clear()`
+                if self._items and self._items[0] is item:
+                    self._items.popleft()
+                continue
+            except Exception:
+                LOG.exception(f'failed to render {item}')
+                source = None
+            if self._items and self._items[0] is item:
+                self._items.popleft()
+            # start rendering the next one while this one is playing
+            self._prefetch()
+            if source is None:
+                continue
+            if item.discarded:
+                source.cleanup()
+                metrics.DROPPED.inc()
+                continue
+
+            vcl = await self._wait_connected()
+            if vcl is None:
+                LOG.warning(f'voice client is not connected, dropped {item}')
+                source.cleanup()
+                metrics.DROPPED.inc()
+                continue
+            done = asyncio.Event()
+
+            def after(error: Optional[Exception]):
+                if error is not None:
+                    LOG.error(f'player error: {error!r}')
+                loop.call_soon_threadsafe(done.set)
+
+            start = time.monotonic()
+            metrics.QUEUE_WAIT_SECONDS.observe(start - item.enqueued_at)
+            try:
+                vcl.play(source, after=after)
+            except discord.ClientException as e:
+                LOG.warning(f'failed to play {item}: {e}')
+                source.cleanup()
+                metrics.DROPPED.inc()
+                continue
+            self._playing, self._playing_since = item, start
+            try:
+                await done.wait()
+            finally:
+                self._playing = None
+            metrics.PLAYBACK_SECONDS.observe(time.monotonic() - start)
+            metrics.UTTERANCES.inc()
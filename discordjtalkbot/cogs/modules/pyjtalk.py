@@ -1,50 +1,230 @@
-"""openjtalk module command line util """
+"""openjtalk module command line util
 
+usage:
+    python3 -m cogs.modules.pyjtalk -t TEXT [--stream] [-j JOBS]
+                                    [OPEN_JTALK_OPTIONS]
+    python3 -m cogs.modules.pyjtalk --batch FILE [-o DIR] [--format FORMAT]
+                                    [-j JOBS] [OPEN_JTALK_OPTIONS]
+
+`--batch` synthesizes each line of FILE (`-` for stdin) in parallel and
+writes `NNNN.wav` (or `NNNN.opus`) files numbered by line into DIR.
+`--stream` splits TEXT into sentences and starts playing the first one
+while up to JOBS following ones are synthesized.
+"""
+
+import concurrent.futures
 import io
+import os
+import sys
+import time
 import wave
 from argparse import ArgumentParser
+from ctypes.util import find_library
 from itertools import chain
+from os.path import join
+from typing import Iterable, List, Optional
 
-import pyaudio
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
 
 from . import openjtalk
 
+FORMAT_WAV = 'wav'
+FORMAT_OPUS = 'opus'
+FORMATS = (FORMAT_WAV, FORMAT_OPUS)
+
+
+def play(agent: openjtalk.Agent, text: str):
+    """synthesize `text` and play it with PyAudio """
+
+    play_stream(agent, [text], readahead=0)
+
+
+def play_stream(agent: openjtalk.Agent, texts: Iterable[str],
+                readahead: Optional[int] = None):
+    """play `texts` in order with PyAudio, synthesizing up to `readahead`
+    following texts while one is playing, and print the time to the
+    first audio to stderr """
+
+    if pyaudio is None:
+        raise SystemExit('playing requires pyaudio')
+    pa = pyaudio.PyAudio()
+    stream = None
+    params = None
+    start = time.perf_counter()
+    try:
+        for wave_bytes in agent.talk_stream(texts, readahead=readahead):
+            if not wave_bytes:
+                continue
+            with wave.open(io.BytesIO(wave_bytes), 'rb') as wf:
+                sampwidth = wf.getsampwidth()
+                nchannels = wf.getnchannels()
+                rate = wf.getframerate()
+                if stream is None or params != (sampwidth, nchannels, rate):
+                    if stream is None:
+                        print(f'first audio in {time.perf_counter() - start:.2f}s',
+                              file=sys.stderr)
+                    else:
+                        _close_stream(stream)
+                    params = (sampwidth, nchannels, rate)
+                    pa_format = pa.get_format_from_width(sampwidth)
+                    stream = pa.open(rate, nchannels, pa_format, output=True)
+                chunk = 4096
+                while True:
+                    frame_data = wf.readframes(chunk)
+                    if not frame_data:
+                        break
+                    stream.write(frame_data)
+    finally:
+        if stream is not None:
+            _close_stream(stream)
+        pa.terminate()
+
+
+def _close_stream(stream):
+    """(internal) stop and close a PyAudio `stream` """
+
+    stream.stop_stream()
+    stream.close()
+
+
+def encode_opus(data: bytes) -> bytes:
+    """return wave `data` encoded into an Ogg Opus file (48kHz stereo) """
+
+    import discord
+    from . import audiosource
+
+    source = audiosource.WavePCMSource(data)
+    encoder = discord.opus.Encoder()
+    packets = []
+    while True:
+        frame = source.read()
+        if not frame:
+            break
+        packets.append(encoder.encode(frame, encoder.SAMPLES_PER_FRAME))
+    return audiosource.ogg_opus(packets)
+
+
+def wave_seconds(data: bytes) -> float:
+    """return the length in seconds of wave `data` (0 if broken) """
+
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wf:
+            return wf.getnframes() / wf.getframerate()
+    except (wave.Error, EOFError):
+        return 0.0
+
+
+def batch(agent: openjtalk.Agent, lines: List[str], outdir: str,
+          fmt: str = FORMAT_WAV, jobs: int = openjtalk.SYNTH_WORKERS):
+    """synthesize the non-empty `lines` in parallel into files in
+    `outdir` and print a throughput summary to stderr """
+
+    if fmt == FORMAT_OPUS:
+        import discord
+        if not discord.opus.is_loaded():
+            name = find_library('opus')
+            try:
+                if name is None:
+                    raise OSError('libopus not found')
+                discord.opus.load_opus(name)
+            except (OSError, AttributeError):
+                raise SystemExit('Opus output requires the Opus library')
+    os.makedirs(outdir, exist_ok=True)
+    numbered = [(n, line.strip()) for n, line in enumerate(lines, 1)
+                if line.strip()]
+    width = max(4, len(str(len(lines))))
+
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    failed = 0
+    # Opus encoding (ctypes releases the GIL) runs on threads meanwhile
+    with concurrent.futures.ThreadPoolExecutor(jobs) as encoders:
+        writes = []
+        results = agent.talk_many([text for _, text in numbered],
+                                  stereo=False, max_workers=jobs)
+        for i, data in results:
+            n = numbered[i][0]
+            if not data:
+                failed += 1
+                print(f'failed line {n}: {numbered[i][1]!r}', file=sys.stderr)
+                continue
+            audio_seconds += wave_seconds(data)
+            filename = join(outdir, f'{n:0{width}d}.{fmt}')
+            if fmt == FORMAT_OPUS:
+                writes.append(encoders.submit(_write_opus, filename, data))
+            else:
+                _write(filename, data)
+        for future in writes:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    done = len(numbered) - failed
+    print(f'{done} files ({failed} failed) in {elapsed:.2f}s with {jobs} jobs:'
+          f' {done / elapsed if elapsed else 0:.1f} lines/s,'
+          f' {audio_seconds:.1f}s of audio'
+          f' ({audio_seconds / elapsed if elapsed else 0:.1f}x realtime)',
+          file=sys.stderr)
+
+
+def _write(filename: str, data: bytes):
+    """(internal) write `data` to `filename` """
+
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+
+def _write_opus(filename: str, data: bytes):
+    """(internal) write wave `data` encoded into Opus to `filename` """
+
+    _write(filename, encode_opus(data))
+
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('-t', '--text')
+    parser.add_argument('--stream', action='store_true',
+                        help='play TEXT sentence by sentence synthesizing ahead')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='synthesize each line of FILE (- for stdin) into files')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='directory of the files of --batch (%(default)s)')
+    parser.add_argument('--format', choices=FORMATS, default=FORMAT_WAV,
+                        help='file format of --batch (%(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=openjtalk.SYNTH_WORKERS,
+                        help='number of parallel jobs of --batch and --stream (%(default)s)')
     for m in openjtalk.OPTION_MAPPINGS:
         parser.add_argument(m.option, type=str, help=m.help)
     ns_args = parser.parse_args()
 
     d_args = vars(ns_args)
     text = d_args.pop('text')
+    stream = d_args.pop('stream')
+    batch_file = d_args.pop('batch')
+    outdir = d_args.pop('outdir')
+    fmt = d_args.pop('format')
+    jobs = d_args.pop('jobs')
     agent_args = chain.from_iterable(
         ('-' + k, v) for k, v in d_args.items() if v is not None)
     agent = openjtalk.Agent.from_args(agent_args)
-    print(agent)
-    pa = pyaudio.PyAudio()
-    try:
-        wave_bytes = agent.talk(text)
-        with io.BytesIO(wave_bytes) as bytes_io:
-            with wave.open(bytes_io, 'rb') as wf:
-                sampwidth = wf.getsampwidth()
-                nchannels = wf.getnchannels()
-                rate = wf.getframerate()
-                pa_format = pa.get_format_from_width(sampwidth)
-                stream = pa.open(rate, nchannels, pa_format, output=True)
-                try:
-                    chunk = 4096
-                    while True:
-                        frame_data = wf.readframes(chunk)
-                        if not frame_data:
-                            break
-                        stream.write(frame_data)
-                finally:
-                    stream.stop_stream()
-                    stream.close()
-    finally:
-        pa.terminate()
+    print(agent, file=sys.stderr if batch_file else sys.stdout)
+
+    if jobs < 1:
+        parser.error('jobs must be >= 1')
+    if batch_file is None:
+        if stream:
+            play_stream(agent, openjtalk.split_sentences(text), jobs)
+        else:
+            play(agent, text)
+        return
+    if batch_file == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(batch_file, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    batch(agent, lines, outdir, fmt, jobs)
 
 
 if __name__ == "__main__":
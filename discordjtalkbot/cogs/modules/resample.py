@@ -0,0 +1,91 @@
+"""vectorized polyphase resampler for 16bit monaural PCM (requires NumPy) """
+
+import logging
+import math
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'is_available',
+    'resample_frames',
+]
+
+
+# taps of each polyphase branch (zero crossings of the sinc on both sides)
+TAPS = 32
+
+# shape parameter of the Kaiser window
+KAISER_BETA = 8.6
+
+# passband edge relative to the Nyquist frequency of the lower rate
+ROLLOFF = 0.92
+
+
+def is_available() -> bool:
+    """return whether resampling is available (NumPy is installed) """
+
+    return np is not None
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filter(up: int, down: int) -> 'np.ndarray':
+    """(internal) return the windowed sinc low-pass filter for resampling
+    by `up/down`, split into `up` branches of `TAPS` taps (reversed for
+    correlation) """
+
+    length = TAPS * up
+    cutoff = ROLLOFF * 0.5 / max(up, down)
+    # offsets in samples of the `up` times rate from the output sample
+    n = np.arange(length) - TAPS // 2 * up
+    window = np.i0(KAISER_BETA * np.sqrt(np.clip(
+        1 - (n / (length / 2)) ** 2, 0, None))) / np.i0(KAISER_BETA)
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * window
+    # keep unity gain of each branch
+    h *= up / h.sum()
+    return h.reshape(TAPS, up).T[:, ::-1].astype(np.float32)
+
+
+def resample_frames(frames: bytes, rate_in: int, rate_out: int) -> bytes:
+    """return 16bit monaural PCM `frames` resampled from `rate_in` to
+    `rate_out` Hz
+
+    Output sample `j` is at input position `j * down / up`; all the
+    samples sharing a branch of the polyphase filter are computed by one
+    matrix product over a strided view of the input, so no sample is
+    computed and thrown away.
+    """
+
+    if np is None:
+        raise RuntimeError('resampling requires NumPy')
+    if rate_in == rate_out:
+        return bytes(frames)
+
+    g = math.gcd(rate_in, rate_out)
+    up, down = rate_out // g, rate_in // g
+    h = _polyphase_filter(up, down)
+
+    x = np.frombuffer(frames, dtype='<i2').astype(np.float32)
+    nout = len(x) * up // down
+    if nout == 0:
+        return b''
+    half = TAPS // 2
+    # window `base` holds the input samples `base - half + 1 ... base + half`
+    padded = np.concatenate([np.zeros(half - 1, np.float32), x,
+                             np.zeros(half + 1, np.float32)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, TAPS)
+
+    y = np.empty(nout, np.float32)
+    for j0 in range(min(up, nout)):
+        phase = j0 * down % up
+        base = j0 * down // up
+        count = len(range(j0, nout, up))
+        # consecutive outputs of the branch advance `down` input samples
+        y[j0::up] = windows[base:base + down * count:down][:count] @ h[phase]
+    return np.clip(np.rint(y), -32768, 32767).astype('<i2').tobytes()
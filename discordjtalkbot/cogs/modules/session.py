@@ -0,0 +1,303 @@
+"""per-guild voice reading sessions """
+
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import discord
+
+from . import audiosource
+from . import metrics
+from . import openjtalk
+from .admission import AdmissionControl
+from .playback import READAHEAD, PlaybackItem, PlaybackQueue
+from .speedrate import AdaptiveSpeedrate
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'GuildSession',
+    'SessionManager',
+    'prewarm',
+]
+
+
+class GuildSession(object):
+    """voice reading session of a guild: the voice channel, the voice
+    client, the playback queue and member-to-voice mapping """
+
+    def __init__(
+            self,
+            guild: discord.Guild,
+            vch: discord.VoiceChannel,
+            agent: openjtalk.Agent,
+            voices: Sequence[str] = (),
+            *,
+            readahead: int = READAHEAD,
+            chunk_chars: int = openjtalk.CHUNK_CHARS,
+            opus_cache: Optional[openjtalk.WaveCache] = None,
+            coalesce: float = 0.0,
+            admission: Optional[AdmissionControl] = None,
+            speed: Optional[AdaptiveSpeedrate] = None):
+        """constructor """
+
+        self.guild = guild
+        self.vch = vch
+        self.agent = agent
+        self.default_voice = agent.voice
+        self.voices_init = [v for v in voices if v]
+        self.voices = []
+        self.member2voice = {}
+        self.chunk_chars = chunk_chars
+        self.opus_cache = opus_cache
+        self.admission = admission
+        self.speed = speed
+        self.queue = PlaybackQueue(
+            self.render, lambda: self.voice_client, readahead=readahead,
+            coalesce=coalesce, max_chars=chunk_chars,
+            estimate=lambda text: openjtalk.estimate_seconds(
+                text, self.speedrate))
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} at {hex(id(self))}' \
+            + f' v:{self.guild}/{self.vch}>'
+
+    @property
+    def voice_client(self) -> Optional[discord.VoiceClient]:
+        """Voice client of the guild (`None` if not connected) """
+
+        return self.guild.voice_client
+
+    @property
+    def speedrate(self) -> Optional[float]:
+        """Current speech rate (adapted to the backlog with `speed`) """
+
+        if self.speed is not None:
+            # 読み上げ待ちがなければ、次の合成を待たずに元の話速へ戻していく
+            if not self.queue.backlog():
+                return self.speed.update(0.0)
+            return self.speed.rate
+        return self.agent.speedrate
+
+    def is_connected(self) -> bool:
+        """return whether the voice client is connected """
+
+        vcl = self.voice_client
+        return vcl is not None and vcl.is_connected()
+
+    def voice_for(self, member_name: str) -> str:
+        """return the voice assigned to the member """
+
+        if not member_name or not self.voices_init:
+            return self.default_voice
+
+        # すでに登録されているか確認
+        voice = self.member2voice.get(member_name)
+        if voice is not None:
+            return voice
+
+        # voicesを使い切ったら、初期のものをシャッフルして振り分け直す
+        if not self.voices:
+            self.voices = list(self.voices_init)
+            random.shuffle(self.voices)
+        voice = self.voices.pop()
+        self.member2voice[member_name] = voice
+        LOG.info(f'set voice({voice}) to member({member_name}) on {self.guild}.')
+        return voice
+
+    def talk(self, text: str, member_name: str = '',
+             channel: Optional[int] = None) -> List[PlaybackItem]:
+        """queue `text` to be read with the member's voice, split into
+        sentences so that the first one starts playing early
+
+        Messages of a burst in the same text channel `channel` (an id)
+        may be merged into one utterance (see `PlaybackQueue`). With
+        `admission`, the text may be truncated or dropped (an empty list
+        is returned) not to exceed the latency target.
+        """
+
+        if self.admission is not None:
+            text = self.admission.admit(
+                text, self.queue.backlog(), self.speedrate)
+            if text is None:
+                return []
+        voice = self.voice_for(member_name)
+        LOG.debug(f'member:{member_name}, voice:{voice}')
+        chunks = openjtalk.split_sentences(text, self.chunk_chars)
+        return self.queue.extend(chunks, voice, channel)
+
+    async def render(self, item: PlaybackItem
+                     ) -> Optional[discord.AudioSource]:
+        """[Coroutine] synthesize the queued item into an audio source """
+
+        # 読み上げ待ちが長ければ速く読む
+        options = {'voice': item.voice}
+        if self.speed is not None:
+            speedrate = self.speed.update(self.queue.backlog())
+            item.seconds = openjtalk.estimate_seconds(item.text, speedrate)
+            # 元の話速のときは指定しない(prewarmと同じキャッシュのキーにする)
+            if speedrate != self.speed.base:
+                options['speedrate'] = speedrate
+
+        # 符号化済みの音声があれば、合成も符号化もせずにそのまま再生する
+        opus_key = None
+        if self.opus_cache is not None and discord.opus.is_loaded():
+            opus_key = self.agent.config(**options).cache_key(item.text)
+            packets = self.opus_cache.get(opus_key)
+            if packets is not None:
+                LOG.info(f'talk(opus cache):{item.text}')
+                return audiosource.OpusPacketSource(packets)
+
+        start = time.perf_counter()
+        try:
+            data = await self.agent.async_talk(
+                item.text, stereo=False, **options)
+        except openjtalk.SynthesisRejected as e:
+            LOG.warning(f'skipped {item}: {e}')
+            metrics.SYNTH_FAILURES.inc()
+            return None
+        metrics.SYNTH_SECONDS.observe(time.perf_counter() - start)
+        voice_name = re.sub('.+/', '', item.voice)
+        LOG.info(f'talk({voice_name}):{item.text}')
+        if self.agent.cache is not None:
+            LOG.debug(f'cache: {self.agent.cache.stats()}')
+        if not data:
+            metrics.SYNTH_FAILURES.inc()
+            return None
+        source = audiosource.WavePCMSource(data)
+        if discord.opus.is_loaded():
+            # 符号化の時間を計測するため、ボイスクライアントではなく自前で符号化する
+            # (最後まで再生したら符号化済みの音声をキャッシュする)
+            on_complete = None
+            if opus_key is not None:
+                on_complete = lambda packets: self.opus_cache.put(opus_key, packets)
+            source = audiosource.OpusEncodingSource(source, on_complete)
+        return source
+
+    def stop(self) -> bool:
+        """discard queued items, stop playing and return whether it was
+        playing """
+
+        return self.queue.stop()
+
+    async def close(self):
+        """stop playing and disconnect from the voice channel """
+
+        await self.queue.close()
+        vcl = self.voice_client
+        if vcl and vcl.is_connected():
+            await vcl.disconnect()
+
+
+class SessionManager(object):
+    """registry of `GuildSession` objects keyed by guild id """
+
+    def __init__(self):
+        """constructor """
+
+        self._sessions: Dict[int, GuildSession] = {}
+
+    def __len__(self) -> int:
+        """return the number of active sessions """
+
+        return len(self._sessions)
+
+    def __contains__(self, guild_id: int) -> bool:
+        """return whether the guild has an active session """
+
+        return guild_id in self._sessions
+
+    def __iter__(self) -> Iterator[GuildSession]:
+        """return iterator of the active sessions """
+
+        return iter(list(self._sessions.values()))
+
+    def get(self, guild_id: int) -> Optional[GuildSession]:
+        """return the session of the guild or `None` """
+
+        return self._sessions.get(guild_id)
+
+    def add(self, session: GuildSession) -> GuildSession:
+        """register `session` replacing the old one of the same guild """
+
+        self._sessions[session.guild.id] = session
+        LOG.info(f'session opened: {session}')
+        return session
+
+    def discard(self, guild_id: int) -> Optional[GuildSession]:
+        """unregister and return the session of the guild (if any) """
+
+        session = self._sessions.pop(guild_id, None)
+        if session is not None:
+            LOG.info(f'session closed: {session}')
+        return session
+
+    async def close(self, guild_id: int):
+        """unregister the session of the guild and disconnect it """
+
+        session = self.discard(guild_id)
+        if session is not None:
+            await session.close()
+
+    async def close_all(self):
+        """close all the sessions """
+
+        for session in self:
+            await self.close(session.guild.id)
+
+
+def _encode_all(source: audiosource.OpusEncodingSource):
+    """(internal) read `source` to the end to encode all the frames """
+
+    while source.read():
+        pass
+
+
+async def prewarm(agent: openjtalk.Agent, texts: Sequence[str],
+                  voices: Sequence[str],
+                  opus_cache: Optional[openjtalk.WaveCache] = None,
+                  chunk_chars: int = openjtalk.CHUNK_CHARS) -> int:
+    """[Coroutine] synthesize `texts` with each of `voices` into the
+    caches so that they are played without waiting for `open_jtalk`, and
+    return the number of clips cached
+
+    Clips are synthesized one by one not to hold up the workers for the
+    messages coming in meanwhile. Each text is split into chunks by
+    `split_sentences` with `chunk_chars` as `GuildSession.talk` does, so
+    that the clips are stored with the same keys as
+    `GuildSession.render` looks up.
+    """
+
+    opus_cache = opus_cache if discord.opus.is_loaded() else None
+    if agent.cache is None and opus_cache is None:
+        return 0
+
+    chunks = [c for t in texts if t
+              for c in openjtalk.split_sentences(t, chunk_chars)]
+    loop = asyncio.get_event_loop()
+    count = 0
+    for voice in dict.fromkeys(v for v in voices if v):
+        for text in dict.fromkeys(chunks):
+            opus_key = agent.config(voice=voice).cache_key(text)
+            if opus_cache is not None and opus_key in opus_cache:
+                continue
+            try:
+                data = await agent.async_talk(text, voice=voice, stereo=False)
+            except openjtalk.OpenJTalkError as e:
+                LOG.warning(f'failed to prewarm {text!r}: {e}')
+                continue
+            if not data:
+                continue
+            if opus_cache is not None:
+                source = audiosource.OpusEncodingSource(
+                    audiosource.WavePCMSource(data),
+                    lambda packets: opus_cache.put(opus_key, packets))
+                await loop.run_in_executor(None, _encode_all, source)
+            count += 1
+    return count
@@ -0,0 +1,98 @@
+"""speech rate adapted to the backlog of a session """
+
+import logging
+import math
+import time
+
+logging.basicConfig()
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'AdaptiveSpeedrate',
+]
+
+
+# backlog in seconds above which the rate goes up
+HIGH = 20.0
+
+# backlog in seconds below which the rate goes back down
+LOW = 5.0
+
+# unit of the rate and its change at a time going back down
+STEP = 0.1
+
+# min seconds between changes of the rate going back down
+INTERVAL = 2.0
+
+
+class AdaptiveSpeedrate(object):
+    """speech rate following the estimated backlog with hysteresis
+
+    While the backlog (estimated at the current rate) is longer than
+    `high` seconds, the rate goes up at once to the one reading it in
+    `high` seconds. While it is shorter than `low`, the rate goes back
+    down by `step` for every `interval` seconds elapsed since it was
+    last changed or the backlog was last longer, so that it is back to
+    `base` after an idle gap. In between it is kept. The rate stays
+    within `base` and `maximum`, and is a multiple of `step` from `base`
+    so that the voices synthesized at each rate are cached.
+    """
+
+    __slots__ = ['base', 'maximum', 'high', 'low', 'step', 'interval',
+                 'rate', '_changed_at']
+
+    def __init__(self, base: float, maximum: float, *,
+                 high: float = HIGH, low: float = LOW, step: float = STEP,
+                 interval: float = INTERVAL):
+        """constructor """
+
+        if maximum < base:
+            raise ValueError(f'maximum must be >= {base}: {maximum}')
+        if not 0 < low <= high:
+            raise ValueError(f'0 < low <= high is required: {low}, {high}')
+        self.base = base
+        self.maximum = maximum
+        self.high = high
+        self.low = low
+        self.step = step
+        self.interval = interval
+        self.rate = base
+        self._changed_at = 0.0
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{__name__}.{self.__class__.__name__} {self.rate}' \
+            + f' ({self.base}-{self.maximum})>'
+
+    def update(self, backlog: float) -> float:
+        """return the rate for `backlog` seconds of speech waiting
+
+        >>> speed = AdaptiveSpeedrate(1.0, 2.0, high=10.0, low=2.0)
+        >>> speed.update(15.0), speed.update(5.0), speed.update(12.0)
+        (1.5, 1.5, 1.8)
+        """
+
+        now = time.monotonic()
+        rate = self.rate
+        if backlog > self.high:
+            self._changed_at = now
+            rate = max(rate, self._quantize(rate * backlog / self.high))
+        elif backlog < self.low:
+            # one step for every interval elapsed with a short backlog
+            steps = int((now - self._changed_at) // self.interval)
+            rate = max(self.base, rate - steps * self.step)
+        else:
+            self._changed_at = now
+        rate = round(min(self.maximum, rate), 3)
+        if rate != self.rate:
+            LOG.info(f'speedrate {self.rate} -> {rate} (backlog {backlog:.1f}s)')
+            self.rate = rate
+            self._changed_at = now
+        return self.rate
+
+    def _quantize(self, rate: float) -> float:
+        """(internal) return `rate` rounded up to a multiple of `step` from
+        `base` """
+
+        return self.base + math.ceil(round((rate - self.base) / self.step, 6)) * self.step
@@ -20,9 +20,9 @@ INITIAL_EXTENSIONS = ['cogs.autoreadercog']
 HELP_COLOR_NORMAL = 0x0000bb
 HELP_COLOR_WARN = 0xbb0000
 class DiscordJTalkBot(commands.Bot):
-    def __init__(self, command_prefix, help_command, intents):
+    def __init__(self, command_prefix, help_command, intents, **options):
         # スーパークラスのコンストラクタに値を渡して実行。
-        super().__init__(command_prefix, case_insensitive = True, help_command=help_command, intents=intents)
+        super().__init__(command_prefix, case_insensitive = True, help_command=help_command, intents=intents, **options)
         # INITIAL_EXTENSIONに格納されている名前からCogを読み込む。
         # エラーが発生した場合、エラー内容を表示する。
         for cog in INITIAL_EXTENSIONS:
@@ -32,6 +32,12 @@ class DiscordJTalkBot(commands.Bot):
                 LOG.warning("traceback:", stack_info=True)
 
 
+# シャーディング版。shard_idsで指定したシャードのギルドだけを担当する。
+# (launcher.pyで複数のプロセスに分けて起動すると、合成や符号化が複数のコアで動く)
+class ShardedDiscordJTalkBot(DiscordJTalkBot, commands.AutoShardedBot):
+    pass
+
+
 # クラス定義。HelpCommandクラスを継承。
 class Help(commands.HelpCommand):
 
@@ -131,24 +137,91 @@ class Help(commands.HelpCommand):
             return f'{command.qualified_name} に {string} というサブコマンドは登録されていません。'
         return f'{command.qualified_name} にサブコマンドは登録されていません。'
 
+
+def add_fields(appenv: environ.ApplicationEnvironment):
+    """register the setting fields of the bot to `appenv` """
+
+    appenv.add_field('prefix', default='$', help='command prefix (%(default)s)')
+    appenv.add_field('token', help='bot token')
+    appenv.add_field('voice_hello', default='')
+    appenv.add_field('text_start', default='',
+                    help='message posted to the text channel when reading starts')
+    appenv.add_field('text_end', default='',
+                    help='message posted to the text channel when reading ends')
+    appenv.add_field('open_jtalk_flags', default='-x /usr/local/opt/open-jtalk/dic -m /usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice',
+                    help='open jtalk settings  (%(default)s)')
+    appenv.add_field('voices', type=environ.string_list, default='/usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice',
+                    help='voices  (%(default)s)')
+    appenv.add_field('except_prefix', type=environ.string_list, default='$',
+                    help='ignore prefix charactor  (%(default)s)')
+    appenv.add_field('read_name', type=environ.boolean, default=False,
+                    help="read message author's name")
+    appenv.add_field('read_system_message', type=environ.boolean, default=False,
+                    help="read system messsage")
+    appenv.add_field('read_all_guild', type=environ.boolean, default=False,
+                    help="read all guild messsage")
+    appenv.add_field('read_all_guild_target', type=int, default=0,
+                    help='id of the guild to read the messages of the other guilds in with read_all_guild, 0 not to read them (%(default)s)')
+    appenv.add_field('synth_rate', type=int, default=48000,
+                    help='sampling frequency to synthesize at, upsampled to 48000 with NumPy (%(default)s)')
+    appenv.add_field('prewarm', type=environ.boolean, default=True,
+                    help='synthesize the fixed phrases with every voice at startup (%(default)s)')
+    appenv.add_field('warm_files', type=environ.boolean, default=False,
+                    help='read the dictionary and voice files into the page cache at startup (%(default)s)')
+    appenv.add_field('lock_files', type=environ.boolean, default=False,
+                    help='also lock the dictionary and voice files in memory with mlock (%(default)s)')
+    appenv.add_field('cache_bytes', type=int, default=32 * 1024 * 1024,
+                    help='byte budget of the synthesized voice cache, 0 to disable (%(default)s)')
+    appenv.add_field('opus_cache_bytes', type=int, default=8 * 1024 * 1024,
+                    help='byte budget of the pre-encoded Opus clip cache, 0 to disable (%(default)s)')
+    appenv.add_field('synth_readahead', type=int, default=1,
+                    help='number of queued messages synthesized while playing (%(default)s)')
+    appenv.add_field('chunk_chars', type=int, default=80,
+                    help='max characters of a sentence chunk synthesized at once, 0 not to split (%(default)s)')
+    appenv.add_field('coalesce_ms', type=int, default=0,
+                    help='window in ms to merge consecutive messages while playing, 0 to disable (%(default)s)')
+    appenv.add_field('latency_target', type=float, default=0.0,
+                    help='max estimated seconds until a message is read out, 0 to disable (%(default)s)')
+    appenv.add_field('latency_policy', default='drop',
+                    help='policy for a message exceeding latency_target: drop or summarize (%(default)s)')
+    appenv.add_field('max_message_seconds', type=float, default=0.0,
+                    help='max estimated seconds of a message, truncated if longer, 0 to disable (%(default)s)')
+    appenv.add_field('speedrate_max', type=float, default=0.0,
+                    help='max speech rate raised while the backlog is long, 0 to disable (%(default)s)')
+    appenv.add_field('speedrate_high', type=float, default=20.0,
+                    help='backlog in seconds above which the speech rate goes up (%(default)s)')
+    appenv.add_field('speedrate_low', type=float, default=5.0,
+                    help='backlog in seconds below which the speech rate goes back down (%(default)s)')
+    appenv.add_field('synth_workers', type=int, default=os.cpu_count() or 1,
+                    help='max number of concurrent open_jtalk processes (%(default)s)')
+    appenv.add_field('synth_queue', type=int, default=32,
+                    help='max number of synthesis jobs waiting for a worker (%(default)s)')
+    appenv.add_field('synth_overflow', default='reject',
+                    help='policy when the synthesis queue is full: reject, drop_oldest or merge (%(default)s)')
+    appenv.add_field('engine', default='cli',
+                    help='synthesis engine: cli (open_jtalk command) or resident (pyopenjtalk workers) (%(default)s)')
+    appenv.add_field('reading_dict', default='',
+                    help='JSON file of word-to-reading replacements, relative to cogs/modules/files')
+    appenv.add_field('reload_interval', type=float, default=5.0,
+                    help='seconds between checks of the setting file for changes, 0 to disable (%(default)s)')
+    appenv.add_field('sharded', type=environ.boolean, default=False,
+                    help='run as AutoShardedBot (%(default)s)')
+    appenv.add_field('shard_count', type=int, default=0,
+                    help='total number of shards, 0 to use the recommended one (%(default)s)')
+    appenv.add_field('shard_ids', type=environ.string_list, default='',
+                    help='comma separated ids of the shards run in this process, empty for all')
+    appenv.add_field('worker', type=int, default=0,
+                    help='index of the worker process started by launcher.py, added to metrics_port (%(default)s)')
+    appenv.add_field('metrics_port', type=int, default=0,
+                    help='port of the Prometheus metrics endpoint, 0 to disable (%(default)s)')
+    appenv.add_field('metrics_host', default='127.0.0.1',
+                    help='address of the Prometheus metrics endpoint (%(default)s)')
+
+
 if __name__ == "__main__":
 
         appenv = environ.get_appenv()
-        appenv.add_field('prefix', default='$', help='command prefix (%(default)s)')
-        appenv.add_field('token', help='bot token')
-        appenv.add_field('voice_hello')
-        appenv.add_field('open_jtalk_flags', default='-x /usr/local/opt/open-jtalk/dic -m /usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice',
-                        help='open jtalk settings  (%(default)s)')
-        appenv.add_field('voices', default='/usr/local/opt/open-jtalk/voice/mei/mei_normal.htsvoice',
-                        help='voices  (%(default)s)')
-        appenv.add_field('except_prefix', default='$',
-                        help='ignore prefix charactor  (%(default)s)')
-        appenv.add_field('read_name', default='False',
-                        help="read message author's name")
-        appenv.add_field('read_system_message', default='False',
-                        help="read system messsage")
-        appenv.add_field('read_all_guild', default='False',
-                        help="read all guild messsage")
+        add_fields(appenv)
 
         # environment variables
         BOT_NAME = 'discordjtalkbot'
@@ -200,9 +273,25 @@ if __name__ == "__main__":
         LOG.info(f'{__file__} is running.')
         token = appenv.get('token')
 
-        bot = DiscordJTalkBot(
+        # 設定ファイルで設定されていれば、シャーディングして動かす
+        bot_class = DiscordJTalkBot
+        options = {}
+        if appenv.get('sharded', False):
+            bot_class = ShardedDiscordJTalkBot
+            shard_count = int(appenv.get('shard_count', 0))
+            shard_ids = [int(i) for i in appenv.get('shard_ids', ())]
+            if shard_ids and shard_count <= 0:
+                raise SystemExit('shard_count is required with shard_ids')
+            if shard_count > 0:
+                options['shard_count'] = shard_count
+            if shard_ids:
+                options['shard_ids'] = shard_ids
+            LOG.info(f'shards: {shard_ids or "all"} of {shard_count or "recommended"}')
+
+        bot = bot_class(
                 command_prefix = appenv.get('prefix', '$')
                 ,help_command=Help()
                 ,intents=intents
+                ,**options
             )# 大文字小文字は気にしない
         bot.run(token)
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""launcher running the bot in worker processes, each owning a range of
+shards with its own voice sessions
+
+usage:
+    python3 launcher.py -w WORKERS [-s SHARD_COUNT]
+
+Each worker runs `discordjtalkbot.py` as a `ShardedDiscordJTalkBot` with
+the settings passed through `DISCORDJTALKBOT_*` environment variables.
+Without `-s` the shard count recommended by Discord is used (at least
+`WORKERS`). A worker exiting with an error is restarted.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from os.path import join, dirname, basename
+from typing import Dict, List, Optional
+
+from cogs.modules import environ
+
+logging.basicConfig()
+LOG = logging.getLogger(basename(__file__) + '$' + __name__)
+
+BOT_NAME = 'discordjtalkbot'
+BOT_SCRIPT = join(dirname(__file__), BOT_NAME + '.py')
+CONFIG_FILE = join(dirname(__file__), 'cogs', 'modules', 'files',
+                   BOT_NAME + '-config.json')
+
+# seconds to wait before restarting a failed worker
+RESTART_DELAY = 5.0
+
+# seconds to wait for the workers to exit after SIGTERM
+STOP_TIMEOUT = 10.0
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[range]:
+    """split `shard_count` shards into `workers` contiguous ranges
+
+    >>> shard_ranges(5, 2)
+    [range(0, 3), range(3, 5)]
+    """
+
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for i in range(workers):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append(range(start, stop))
+        start = stop
+    return [r for r in ranges if r]
+
+
+def load_token() -> Optional[str]:
+    """return the bot token from the environment variable or the setting
+    file in the same way as `discordjtalkbot.py` """
+
+    appenv = environ.get_appenv()
+    appenv.add_field('token', help='bot token')
+    appenv.load_env(prefix=BOT_NAME)
+    if os.path.exists(CONFIG_FILE):
+        appenv.load_json(CONFIG_FILE)
+    return appenv.get('token')
+
+
+async def recommended_shards(token: str) -> int:
+    """[Coroutine] return the number of shards recommended by Discord """
+
+    import discord
+
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token.strip(), bot=True)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards
+
+
+class Worker(object):
+    """bot process owning a range of shards """
+
+    def __init__(self, index: int, shards: range, shard_count: int,
+                 env: Dict[str, str]):
+        """constructor """
+
+        self.index = index
+        self.shards = shards
+        self.env = dict(env)
+        prefix = BOT_NAME.upper() + '_'
+        self.env[prefix + 'SHARDED'] = 'True'
+        self.env[prefix + 'SHARD_COUNT'] = str(shard_count)
+        self.env[prefix + 'SHARD_IDS'] = ','.join(map(str, shards))
+        self.env[prefix + 'WORKER'] = str(index)
+        self.proc: Optional[subprocess.Popen] = None
+
+    def __repr__(self) -> str:
+        """return `repr(self)` """
+
+        return f'<{self.__class__.__name__} {self.index}' \
+            + f' shards:{self.shards.start}-{self.shards.stop - 1}>'
+
+    def start(self):
+        """start the process """
+
+        self.proc = subprocess.Popen([sys.executable, BOT_SCRIPT],
+                                     cwd=dirname(BOT_SCRIPT) or None,
+                                     env=self.env)
+        LOG.info(f'started {self} (pid {self.proc.pid})')
+
+    def poll(self) -> Optional[int]:
+        """return the exit code or `None` if running """
+
+        return self.proc.poll() if self.proc is not None else None
+
+    def terminate(self):
+        """send SIGTERM to the process if running """
+
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+
+    def wait(self, timeout: float):
+        """wait for the process to exit, killing it after `timeout` """
+
+        if self.proc is None:
+            return
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            LOG.warning(f'killed {self}')
+            self.proc.kill()
+            self.proc.wait()
+
+
+def run(workers: List[Worker], restart_delay: float = RESTART_DELAY):
+    """run the workers until all of them exit successfully or a signal """
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker in workers:
+        worker.start()
+    restarts: Dict[int, float] = {}
+    running = list(workers)
+    while running and not stopping:
+        time.sleep(0.5)
+        now = time.monotonic()
+        for worker in list(running):
+            if worker.index in restarts:
+                if now >= restarts[worker.index]:
+                    del restarts[worker.index]
+                    worker.start()
+                continue
+            code = worker.poll()
+            if code is None:
+                continue
+            if code == 0:
+                LOG.info(f'{worker} exited.')
+                running.remove(worker)
+            else:
+                LOG.warning(f'{worker} exited with {code}, restart in {restart_delay}s.')
+                restarts[worker.index] = now + restart_delay
+
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait(STOP_TIMEOUT)
+
+
+def main():
+    parser = ArgumentParser(description='run the bot in sharded worker processes')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes (%(default)s)')
+    parser.add_argument('-s', '--shard_count', type=int, default=0,
+                        help='total number of shards, 0 to use the recommended one')
+    parser.add_argument('--restart_delay', type=float, default=RESTART_DELAY,
+                        help='seconds to wait before restarting a failed worker (%(default)s)')
+    ns_args = parser.parse_args()
+    LOG.setLevel(logging.INFO)
+    if ns_args.workers < 1:
+        parser.error('workers must be >= 1')
+
+    shard_count = ns_args.shard_count
+    if shard_count <= 0:
+        token = load_token()
+        if not token:
+            parser.error('token is required to get the recommended shard count')
+        shard_count = asyncio.get_event_loop().run_until_complete(
+            recommended_shards(token))
+        LOG.info(f'recommended shard count: {shard_count}')
+    shard_count = max(shard_count, ns_args.workers)
+
+    env = dict(os.environ)
+    # ワーカーの合成プロセスの合計がコア数を超えないようにする
+    synth_workers = BOT_NAME.upper() + '_SYNTH_WORKERS'
+    if synth_workers not in env:
+        env[synth_workers] = str(max(1, (os.cpu_count() or 1) // ns_args.workers))
+
+    ranges = shard_ranges(shard_count, ns_args.workers)
+    workers = [Worker(i, r, shard_count, env) for i, r in enumerate(ranges)]
+    run(workers, ns_args.restart_delay)
+
+
+if __name__ == "__main__":
+    main()